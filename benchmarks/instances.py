@@ -0,0 +1,61 @@
+"""
+Construction time and memory per OctoEngine for many instances of one program,
+loading the program bytes into each engine against sharing one ProgramImage.
+
+    python benchmarks/instances.py [instances]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path += [os.path.join(root, "vm"), os.path.join(root, "compiler", "hc")]
+
+import hc
+import vm
+from components.image import ProgramImage
+
+hatch = """
+function void main() {
+    let int[5] numbers = [5, 4, 3, 2, 1];
+    let int total = 0;
+    for (let int i = 0; i < numbers; i++) {
+        total = total + numbers[i];
+    }
+    __internal_print(total);
+}
+"""
+
+def construct(instances, program):
+    engines = []
+    for i in range(0, instances):
+        engine = vm.OctoEngine(True, input_source=b"")
+        engine.load(program)
+        engines.append(engine)
+    return engines
+
+def measure(name, instances, program):
+    start = time.perf_counter()
+    construct(instances, program)
+    elapsed = time.perf_counter() - start
+
+    # Measured separately, tracing allocations slows construction down
+    tracemalloc.start()
+    engines = construct(instances, program)
+    memory, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<16} {elapsed/instances*1e6:8.1f} us/instance {memory/instances:10.0f} bytes/instance")
+    return engines
+
+def main():
+    instances = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    code = hc.compile(hatch)
+    print(f"{instances} instances of a {len(code)} byte program")
+    measure("program bytes", instances, code)
+    image = ProgramImage(code)
+    engines = measure("shared image", instances, image)
+    assert engines[-1].run() == [15]
+
+if __name__ == "__main__":
+    main()
@@ -15,6 +15,33 @@ SAVED_REGISTERS = 2
 
 LoopControlBytes = namedtuple("LoopControlBytes", ["breaks", "continues"])
 
+def whole_value_names(node):
+    """
+    Names of variables used as a whole value, rather than indexed or compared:
+    call arguments, returned values and copies. Arrays used like this can reach
+    code that doesn't know which bank they are in, so they stay in bank 0.
+    """
+    names = set()
+    if isinstance(node, (list, tuple)):
+        for item in node:
+            names |= whole_value_names(item)
+        return names
+    if not isinstance(node, Expression):
+        return names
+    values = []
+    if isinstance(node, Call):
+        values = node.args
+    elif isinstance(node, (Return, Assign)):
+        values = [node.value]
+    elif isinstance(node, Let):
+        values = [node.initial]
+    elif isinstance(node, AssignIndex):
+        values = [node.right]
+    names.update(value.name for value in values if isinstance(value, Variable))
+    for child in vars(node).values():
+        names |= whole_value_names(child)
+    return names
+
 class LoopContext:
     def __init__(self, assembler):
         self.assembler = assembler
@@ -36,7 +63,7 @@ class LoopContext:
 
             
 class Assembler:
-    def __init__(self, ast, sub_trees, called_function_names):
+    def __init__(self, ast, sub_trees, called_function_names, harvard=False, banks=1):
         self.ast = ast
         self.sub_trees = sub_trees
         self.called_function_names = called_function_names
@@ -57,6 +84,13 @@ class Assembler:
         self.main = None
         self.non_main_functions = {}
         self.data = {}
+        # Put the data section in its own address space, for an OctoEngine(harvard=True)
+        self.harvard = harvard
+        self.data_section = []
+        # Arrays are spread over the banks of an OctoEngine(banks=banks), everything else stays in bank 0
+        self.banks = banks
+        self.banked_arrays = 0
+        self.whole_value_names = set()
         
         for branch in self.ast:
             if isinstance(branch, Function):
@@ -103,6 +137,21 @@ class Assembler:
 
         self.instructions += [inst, data]
         return len(self.instructions) - 2
+
+    def add_banked_instruction(self, bank, inst, data, mem_flag=False, stack_flag=False):
+        """Add an instruction that reads or writes memory in bank, which is only selected for that instruction."""
+        if bank:
+            self.add_instruction(Instruction.BANK, bank)
+        self.add_instruction(inst, data, mem_flag=mem_flag, stack_flag=stack_flag)
+        if bank:
+            self.add_instruction(Instruction.BANK, 0)
+
+    def array_bank(self, name):
+        """Bank for a new array, taking banks 1, 2, ... 0 in turn, or 0 if the array is used as a whole value."""
+        if self.banks < 2 or name in self.whole_value_names:
+            return 0
+        self.banked_arrays += 1
+        return self.banked_arrays % self.banks
     
     
     def variable_exists(self, namespace, variable):
@@ -114,6 +163,9 @@ class Assembler:
         
         
     def assemble(self):
+        if self.banks > 1:
+            for function in [self.main, *self.non_main_functions.values()]:
+                self.whole_value_names |= whole_value_names(function.body)
         self.parse(NamespaceGroup(self.globals, self.stack), self.main.body)
         self.add_instruction(Instruction.HLT, 0) # HLT
 
@@ -138,12 +190,18 @@ class Assembler:
             self.current_module_name = function_name[0]
             self.parse(namespace, function.body, is_function=True, parameter_identifiers=parameter_identifiers)
         
-        data_start = len(self.instructions)
+        if self.harvard:
+            # Data is read with an offset of -1, so it can't start at address 0
+            self.data_section = [0]
+            section = self.data_section
+        else:
+            section = self.instructions
+        data_start = len(section)
         data_addresses = {}
         for uid, data in self.data.items():
-            address = len(self.instructions)
+            address = len(section)
             data_addresses[uid] = address
-            self.instructions += data
+            section += data
             
         for index, instruction in enumerate(list(self.instructions)):
             if isinstance(instruction, FunctionAddress):
@@ -311,8 +369,11 @@ class Assembler:
         
         self.stack.temp_extra_stack_vars -= extra_stack_vars
         
-    def load_array(self, namespace, array, force_length=None, temporary=False):
+    def load_array(self, namespace, array, force_length=None, temporary=False, bank=0):
         length = force_length or len(array.elements)
+        if bank:
+            # Allocated in the array's bank, and filled in with it selected
+            self.add_instruction(Instruction.BANK, bank)
         self.add_instruction(Instruction.PUSH, length+1)
         self.add_instruction(Instruction.LDA, length)
         self.add_instruction(Instruction.STA, 1, stack_flag=True)
@@ -336,7 +397,11 @@ class Assembler:
                     self.add_instruction(Instruction.STA, 1, stack_flag=True)
                 elif isinstance(element, Variable):
                     self.add_instruction(Instruction.OFF, 0)
+                    if bank:
+                        self.add_instruction(Instruction.BANK, 0)
                     self.add_instruction(Instruction.LDA, self.stack.id_on_stack(namespace.get_namespace()[element.name]), stack_flag=True)
+                    if bank:
+                        self.add_instruction(Instruction.BANK, bank)
                     self.add_instruction(Instruction.OFF, i)
                     self.add_instruction(Instruction.STA, 1, stack_flag=True)
                 else:
@@ -365,6 +430,8 @@ class Assembler:
             
         
         self.add_instruction(Instruction.OFF, 0)
+        if bank:
+            self.add_instruction(Instruction.BANK, 0)
         if temporary:
             self.stack.temp_extra_stack_vars -= 1
         
@@ -392,7 +459,7 @@ class Assembler:
             Register.AX: Instruction.LDA,
             Register.BX: Instruction.LDB,
         }[register]
-        self.add_instruction(load_inst, self.stack.id_on_stack(namespace.get_namespace()[variable.name]), stack_flag=True)
+        self.add_banked_instruction(namespace.bank(variable.name), load_inst, self.stack.id_on_stack(namespace.get_namespace()[variable.name]), stack_flag=True)
         #self.add_instruction(Instruction.LDB, 0)
         #self.add_instruction(Instruction.MOV, mov(Register.OX, Register.BX))
         self.add_instruction(Instruction.OFF, 0)
@@ -508,8 +575,9 @@ class Assembler:
                 identifier = namespace.let(statement.name.lexeme)
                 self.add_instruction(Instruction.STA, self.stack.id_on_stack(identifier), stack_flag=True)
         elif isinstance(statement.initial, Array):
-            identifier = namespace.let(statement.name.lexeme, is_array=True)
-            self.load_array(namespace, statement.initial, force_length=statement.length.value)
+            bank = self.array_bank(statement.name.lexeme)
+            identifier = namespace.let(statement.name.lexeme, is_array=True, bank=bank)
+            self.load_array(namespace, statement.initial, force_length=statement.length.value, bank=bank)
             
         elif isinstance(statement.initial, Index):
             self.parse_index(namespace, statement.initial.variable, statement.initial.index, register=Register.AX)
@@ -623,7 +691,7 @@ class Assembler:
         else:
             raise Exception("Unhandled index assign index")
         
-        self.add_instruction(Instruction.STA, self.stack.id_on_stack(namespace.get_namespace()[statement.left.variable.name]), stack_flag=True)
+        self.add_banked_instruction(namespace.bank(statement.left.variable.name), Instruction.STA, self.stack.id_on_stack(namespace.get_namespace()[statement.left.variable.name]), stack_flag=True)
         self.add_instruction(Instruction.OFF, 0)
         
         
@@ -855,7 +923,7 @@ class Assembler:
                     if identifier in parameter_identifiers:
                         self.add_instruction(Instruction.POP, 1)
                     else:
-                        self.add_instruction(Instruction.FREE, 0, mem_flag=True)
+                        self.add_banked_instruction(namespace.bank(reverse_locals[identifier]), Instruction.FREE, 0, mem_flag=True)
             if streak > 0:
                 self.add_instruction(Instruction.FREE, streak)
             if not is_return:
@@ -870,8 +938,8 @@ class Assembler:
             self.add_instruction(load_inst, expression.value)
 
         elif isinstance(expression, Variable):
-            self.add_instruction(load_inst, self.stack.id_on_stack(namespace.get_namespace()[expression.name]),
-                                 stack_flag=True)
+            self.add_banked_instruction(namespace.bank(expression.name), load_inst,
+                                        self.stack.id_on_stack(namespace.get_namespace()[expression.name]), stack_flag=True)
             if expression.increment:
                 self.add_instruction(Instruction.INC, self.stack.id_on_stack(namespace.get_namespace()[expression.name]),
                                      stack_flag=True)
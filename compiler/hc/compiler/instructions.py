@@ -33,6 +33,7 @@ class Instruction(Enum):
     DIV =   0b11101
     PRC =   0b11110
     DUP =   0b11111
+    BANK =  0b100000
     
 class Register(Enum):
     AX = 0
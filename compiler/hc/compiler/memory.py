@@ -122,12 +122,15 @@ class NamespaceGroup:
         self.locals = {}
         self.is_arrays = {}
         self.is_structs = {}
+        self.banks = {}
         
-    def let(self, name, is_array=False, is_struct=False):
+    def let(self, name, is_array=False, is_struct=False, bank=0):
         uid = uuid.uuid4().hex
         self.locals[name] = uid
         self.is_arrays[name] = is_array
         self.is_structs[name] = is_struct
+        # Memory bank the variable's heap bytes are in, only arrays are ever put outside bank 0
+        self.banks[name] = bank
         self.stack.add(uid)
         return uid
         
@@ -156,6 +159,14 @@ class NamespaceGroup:
 
     def is_struct(self, name):
         return self.get_is_structs()[name]
+
+    def get_banks(self):
+        if self.parent is None:
+            return self.banks
+        return {**self.parent.get_banks(), **self.banks}
+
+    def bank(self, name):
+        return self.get_banks().get(name, 0)
     
     def get(self, *path_name):
         namespace = self.get_namespace()
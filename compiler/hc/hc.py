@@ -8,7 +8,7 @@ from compiler.type_checker import TypeChecker
 from compiler.assembler import Assembler
 from compiler.instructions import Instruction
 
-def compile(source, debug=False, filename="main.hatch"):
+def compile(source, debug=False, filename="main.hatch", harvard=False, banks=1):
     tokenizer = Tokenizer(source, filename)
     tokens = tokenizer.tokenize()
 
@@ -43,17 +43,20 @@ def compile(source, debug=False, filename="main.hatch"):
             trunk.print()
         print()
         
-    assembler = Assembler(tree, sub_trees, called_function_names)
+    assembler = Assembler(tree, sub_trees, called_function_names, harvard, banks)
     instructions, addresses, data_start = assembler.assemble()
+    if harvard:
+        # Code and data go in separate address spaces, load them with ProgramImage(code, data)
+        instructions = (instructions, assembler.data_section)
     if debug:
         return instructions, addresses, data_start
     return instructions
 
-def compile_file(filename, debug):
+def compile_file(filename, debug, harvard=False, banks=1):
     filename = os.path.abspath(filename)
     with open(filename, "r") as source_file:
         source = source_file.read()
-    return compile(source, debug=debug, filename=filename)
+    return compile(source, debug=debug, filename=filename, harvard=harvard, banks=banks)
 
 if __name__ == "__main__":
     start_time = time.perf_counter()
@@ -0,0 +1,18 @@
+import pytest
+
+from components.allocator import BitmapAllocator, OutOfMemoryException
+
+def test_allocator():
+    heap = BitmapAllocator(10, 20)
+    assert heap.allocate(3) == 10
+    assert heap.allocate(0) == 13
+    assert heap.allocate(2) == 14
+    heap.free(10, 2)
+    assert heap.allocate(3) == 16
+    assert heap.allocate(2) == 10
+    assert heap.free_bytes == 1
+    assert heap.is_free(19) and not heap.is_free(12)
+
+    with pytest.raises(OutOfMemoryException):
+        heap.allocate(2)
+    assert heap.allocate(1) == 19
@@ -0,0 +1,49 @@
+import asyncio
+import sys
+
+import hc
+import vm
+
+hatch = """
+import io;
+
+function void main() {
+    io.print(io.read_int() * 2);
+}
+"""
+
+def test_run_async():
+    instructions = hc.compile(hatch)
+
+    async def main():
+        readers = [asyncio.StreamReader() for i in range(0, 20)]
+        engines = [vm.OctoEngine(True, input_source=b"") for reader in readers]
+        for virtual_machine in engines:
+            virtual_machine.load(instructions)
+        tasks = [asyncio.ensure_future(virtual_machine.run_async(budget=10, reader=reader)) for virtual_machine, reader in zip(engines, readers)]
+
+        # Every program is now waiting on READ
+        await asyncio.sleep(0)
+        assert not any(task.done() for task in tasks)
+        for i, reader in enumerate(readers):
+            reader.feed_data(f"{i}\n".encode())
+        return await asyncio.gather(*tasks)
+
+    assert asyncio.get_event_loop().run_until_complete(main()) == [[i*2] for i in range(0, 20)]
+
+def test_run_async_ignores_source():
+    virtual_machine = vm.OctoEngine(True)
+    virtual_machine.load(hc.compile(hatch))
+    virtual_machine.feed(b"4")
+
+    async def main():
+        # The engine would otherwise read sys.stdin once the fed input runs out
+        reader = asyncio.StreamReader()
+        task = asyncio.ensure_future(virtual_machine.run_async(reader=reader))
+        await asyncio.sleep(0)
+        assert not task.done()
+        reader.feed_data(b"1\n")
+        return await task
+
+    assert asyncio.get_event_loop().run_until_complete(main()) == [82]
+    assert virtual_machine.input.source is sys.stdin
@@ -0,0 +1,98 @@
+import pytest
+
+import hc
+import vm
+
+from compiler.instructions import Instruction
+from components.memory import MemoryAccessException, HEAP_END
+from components.allocator import OutOfMemoryException
+from components.snapshot import Snapshot
+
+stack = 0b0100_0000
+
+# The two arrays don't fit in one bank's heap together
+hatch = """
+function void main() {
+    let int[80] first = [1];
+    let int[80] second = [2];
+    first[79] = 9;
+    second[79] = 8;
+    let int x = first[79];
+    __internal_print(x);
+    x = second[79];
+    __internal_print(x);
+    x = first[0];
+    __internal_print(x);
+}
+"""
+
+program = [
+    Instruction.LDA.value, 7,
+    Instruction.PUSH.value, 1,
+    Instruction.STA.value | stack, 1,
+    Instruction.BANK.value, 1,
+    Instruction.PUSH.value, 1,      # same address as the first PUSH, in bank 1's heap
+    Instruction.LDA.value, 9,
+    Instruction.STA.value | stack, 1,
+    Instruction.PRX.value | stack, 1,
+    Instruction.BANK.value, 0,
+    Instruction.PRX.value | stack, 2,
+    Instruction.BANK.value, 2,
+    Instruction.HLT.value, 0,
+]
+
+def test_banks():
+    for jit in (False, True):
+        virtual_machine = vm.OctoEngine(True, jit=jit, banks=2)
+        virtual_machine.load(program)
+        with pytest.raises(MemoryAccessException):
+            virtual_machine.run()
+        assert virtual_machine.output == [9, 7]
+        assert virtual_machine.stack[0] == virtual_machine.stack[1] == len(program)
+
+def test_bank_snapshot():
+    virtual_machine = vm.OctoEngine(True, banks=3)
+    virtual_machine.load(program)
+    virtual_machine.run_cycles(8)
+    assert virtual_machine.memory.bank == 1
+    child = vm.OctoEngine(True, banks=3)
+    child.load(program)
+    child.restore(Snapshot.from_bytes(virtual_machine.snapshot().to_bytes()))
+    for engine in (virtual_machine, child):
+        engine.run()
+        assert engine.output == [9, 7]
+        assert engine.halted
+
+def test_no_compaction_across_banks():
+    fragment = [
+        Instruction.PUSH.value, 1,
+        Instruction.PUSH.value, 1,
+        Instruction.BANK.value, 1,
+        Instruction.PUSH.value, 1,
+        Instruction.PUSH.value, 1,
+        Instruction.DUP.value, 2,
+        Instruction.FREE.value, 1,      # leaves a hole at the start of bank 1's heap
+        Instruction.PUSH.value, 0,
+        Instruction.HLT.value, 0,
+    ]
+    # Only fits if bank 1's second byte slides down, which would move bank 0's second entry with it
+    fragment[15] = HEAP_END - len(fragment) - 1
+    virtual_machine = vm.OctoEngine(True, banks=2)
+    virtual_machine.load(fragment)
+    with pytest.raises(OutOfMemoryException, match="not compacted"):
+        virtual_machine.run()
+    assert list(virtual_machine.stack[0:4]) == [len(fragment), len(fragment)+1, len(fragment), len(fragment)+1]
+
+def test_compiled_banks():
+    with pytest.raises(OutOfMemoryException):
+        virtual_machine = vm.OctoEngine(True)
+        virtual_machine.load(hc.compile(hatch))
+        virtual_machine.run()
+    program = hc.compile(hatch, banks=2)
+    for jit in (False, True):
+        virtual_machine = vm.OctoEngine(True, jit=jit, banks=2)
+        virtual_machine.load(program)
+        assert virtual_machine.run() == [9, 8, 1]
+        # Back in bank 0 with both arrays freed
+        assert virtual_machine.memory.bank == 0
+        assert virtual_machine.heap.occupied == 0 and virtual_machine.memory.banks[1][1] == 0
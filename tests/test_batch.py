@@ -0,0 +1,60 @@
+import pytest
+
+import hc
+import vm
+
+np = pytest.importorskip("numpy")
+
+from components.batch import BatchEngine
+from components.input import InputException
+from components.stack import StackException
+from compiler.instructions import Instruction
+
+hatch = """
+import io;
+
+function void main() {
+    let int n = io.read_int();
+    if (n > 10) {
+        io.print(n - 10);
+    } else {
+        io.print(n + 100);
+    }
+    let int i = 0;
+    while (i < n) {
+        i = i + 3;
+    }
+    io.print(i);
+}
+"""
+
+def test_batch_matches_engines():
+    program = hc.compile(hatch)
+    inputs = [b"5\n", b"42\n", b"0\n", b"11\n", b"7"]
+    batch = BatchEngine(program, inputs)
+    outputs = batch.run()
+
+    for lane, data in enumerate(inputs):
+        virtual_machine = vm.OctoEngine(True, input_source=data)
+        virtual_machine.load(program)
+        try:
+            expected = virtual_machine.run()
+        except InputException:
+            expected = virtual_machine.output
+        assert outputs[lane] == expected
+        assert batch.halted[lane] == virtual_machine.halted
+        assert bytes(batch.memory[lane, :250]) == bytes(virtual_machine.memory.memory[:250])
+    # The last lane ran out of input part way through read_int
+    assert isinstance(batch.errors[-1], InputException)
+
+@pytest.mark.parametrize("operand", [
+    [Instruction.LDA.value | 0b0100_0000, 3],
+    [Instruction.LDA.value | 0b0100_0000, 0],
+    [Instruction.DUP.value, 2],
+])
+def test_batch_stack_operand_underflow(operand):
+    program = [Instruction.PUSH.value, 1] + operand + [Instruction.HLT.value, 0]
+    batch = BatchEngine(program, [b""])
+    batch.run()
+    assert isinstance(batch.errors[0], StackException)
+    assert batch.sp[0] == 1
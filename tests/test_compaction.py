@@ -0,0 +1,60 @@
+import vm
+
+from compiler.instructions import Instruction
+
+MEM = 0b1000_0000
+STACK = 0b0100_0000
+
+program = [
+    Instruction.PUSH.value, 60,                 # a at 38
+    Instruction.LDA.value, 59,
+    Instruction.STA.value | STACK, 1,
+    Instruction.PUSH.value, 100,                # b at 98
+    Instruction.LDA.value, 42,
+    Instruction.STA.value | STACK, 1,
+    Instruction.PUSH.value, 40,                 # c at 198
+    Instruction.LDA.value, 39,
+    Instruction.STA.value | STACK, 1,
+    Instruction.FREE.value | MEM, 0,            # free c
+    Instruction.DUP.value, 2,
+    Instruction.FREE.value | MEM, 0,            # free a, leaving two gaps
+    Instruction.DUP.value, 1,                   # share b
+    Instruction.LDA.value, 38,
+    Instruction.LDB.value, 100,
+    Instruction.SAVE.value, 0,                  # register values that look like heap addresses
+    Instruction.PUSH.value, 100,                # only fits once b has been moved down
+    Instruction.PRX.value | STACK, 4,
+    Instruction.HLT.value, 0,
+]
+
+def test_compaction():
+    virtual_machine = vm.OctoEngine(True)
+    virtual_machine.load(program)
+    assert virtual_machine.run() == [42]
+    assert list(virtual_machine.stack[:virtual_machine.sp]) == [38, 38, 38, 38, 100, 138]
+    assert virtual_machine.heap.stats["compactions"] == 1
+    assert virtual_machine.heap.stats["bytes_moved"] == 100
+
+def test_compaction_after_popped_save():
+    program = [
+        Instruction.PUSH.value, 1,              # a
+        Instruction.PUSH.value, 1,              # b
+        Instruction.LDA.value, 7,
+        Instruction.STA.value | STACK, 1,
+        Instruction.SAVE.value, 0,
+        Instruction.POP.value, 2,               # drops the saved pair without a RET
+        Instruction.DUP.value, 1,               # pointers to b where the pair was
+        Instruction.DUP.value, 1,
+        Instruction.DUP.value, 4,
+        Instruction.FREE.value, 1,              # free a, leaving a gap below b
+        Instruction.PUSH.value, 0,              # size set below, only fits once b has moved down
+        Instruction.PRX.value | STACK, 2,
+        Instruction.HLT.value, 0,
+    ]
+    program[-5] = 256 - 16 - len(program) - 1
+    virtual_machine = vm.OctoEngine(True)
+    virtual_machine.load(program)
+    assert virtual_machine.run() == [7]
+    start = len(program)
+    assert list(virtual_machine.stack[:virtual_machine.sp]) == [start, start, start, start, start + 1]
+    assert virtual_machine.saved == []
@@ -0,0 +1,29 @@
+import vm
+
+from compiler.instructions import Instruction
+
+jumps = {
+    Instruction.JE: lambda a, b: a == b,
+    Instruction.JNE: lambda a, b: a != b,
+    Instruction.JG: lambda a, b: a > b,
+    Instruction.JL: lambda a, b: a < b,
+    Instruction.JGE: lambda a, b: a >= b,
+    Instruction.JLE: lambda a, b: a <= b,
+}
+
+def test_comparison():
+    for a, b in [(3, 7), (7, 7), (7, 3), (0, 255)]:
+        for jump, predicate in jumps.items():
+            program = [
+                Instruction.LDA.value, a,
+                Instruction.LDB.value, b,
+                Instruction.CMP.value, 0,
+                jump.value, 12,
+                Instruction.PRX.value, 0,
+                Instruction.HLT.value, 0,
+                Instruction.PRX.value, 1,
+                Instruction.HLT.value, 0,
+            ]
+            virtual_machine = vm.OctoEngine(True)
+            virtual_machine.load(program)
+            assert virtual_machine.run() == [int(predicate(a, b))]
@@ -0,0 +1,35 @@
+import hc
+import vm
+
+from components.instructions import dispatch, LDA, LDA_mem, LDA_stack, LDA_stack_mem
+
+hatch = """
+import io;
+
+function void main() {
+    let int[3] array = [4, 5, 6];
+    for (let int i=0; i<3; i=i+1) {
+        io.print(array[i]);
+    }
+}
+"""
+
+def test_dispatch_table():
+    assert len(dispatch) == 256
+    assert dispatch[0b0000_0001] is LDA
+    assert dispatch[0b1000_0001] is LDA_mem
+    assert dispatch[0b0100_0001] is LDA_stack
+    assert dispatch[0b1100_0001] is LDA_stack_mem
+
+def test_debug_dispatch(capsys, monkeypatch):
+    monkeypatch.setattr("settings.step", False)
+    instructions = hc.compile(hatch)
+
+    release = vm.OctoEngine(True)
+    release.load(instructions)
+
+    debug = vm.OctoEngine(True, debug=True)
+    debug.load(instructions)
+
+    assert release.run() == debug.run() == [4, 5, 6]
+    assert "Instruction LDA" in capsys.readouterr().out
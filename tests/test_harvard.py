@@ -0,0 +1,49 @@
+import pytest
+
+import hc
+import vm
+
+from components.image import ProgramImage
+from components.memory import MemoryAccessException
+
+hatch = """
+import io;
+
+function void main() {
+    let int[24] array = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23, 24];
+    let int total = 0;
+    for (let int i=0; i<24; i=i+1) {
+        total = total + array[i];
+    }
+    io.print(total);
+    io.print(array[23]);
+}
+"""
+
+def test_harvard():
+    expected = vm.OctoEngine(True)
+    expected.load(hc.compile(hatch))
+    expected.run()
+
+    code, data = hc.compile(hatch, harvard=True)
+    assert len(data) > 24
+    for jit in (False, True):
+        virtual_machine = vm.OctoEngine(True, jit=jit, harvard=True)
+        virtual_machine.load(ProgramImage(code, data))
+        assert virtual_machine.run() == expected.output == [44, 24]
+        # The heap starts after the data instead of after the code and data
+        assert virtual_machine.heap.start == len(data) < expected.heap.start
+
+def test_harvard_code_is_not_data():
+    code, data = hc.compile(hatch, harvard=True)
+    virtual_machine = vm.OctoEngine(True, harvard=True)
+    virtual_machine.load(ProgramImage(code, data))
+    virtual_machine.run()
+    # Stores can't reach the code, which is not in the data space at all
+    assert bytes(virtual_machine.code[:len(code)]) == bytes(code)
+    assert bytes(virtual_machine.memory.memory[:len(data)]) == bytes(data)
+
+def test_data_needs_harvard():
+    code, data = hc.compile(hatch, harvard=True)
+    with pytest.raises(MemoryAccessException):
+        vm.OctoEngine(True).load(ProgramImage(code, data))
@@ -0,0 +1,51 @@
+import hc
+import vm
+
+from compiler.instructions import Instruction
+
+hatch = """
+import io;
+
+function int triangle_number(int n) {
+    if (n == 1) {
+        return 1;
+    } else {
+        return n + triangle_number(n-1);
+    }
+}
+
+function int main() {
+    io.print(triangle_number(3));
+}
+"""
+
+def test_heap_profiler():
+    virtual_machine = vm.OctoEngine(True)
+    virtual_machine.load(hc.compile(hatch))
+    profiler = virtual_machine.profile_heap()
+    assert virtual_machine.run() == [6,]
+
+    stats = profiler.stats(virtual_machine)
+    assert stats["peak"] == virtual_machine.heap.peak > 0
+    assert stats["leaks"] == []
+    assert stats["events"] == len(profiler.events())
+    assert max(live for cycle, live in profiler.timeline()) == stats["peak"]
+
+def test_leaks():
+    program = [
+        Instruction.PUSH.value, 3,
+        Instruction.PUSH.value, 1,
+        Instruction.PUSH.value, 1,
+        Instruction.FREE.value, 1,
+        Instruction.HLT.value, 0,
+    ]
+    virtual_machine = vm.OctoEngine(True)
+    virtual_machine.load(program)
+    # Only room for the last two events
+    profiler = virtual_machine.profile_heap(capacity=2)
+    virtual_machine.run()
+
+    start = len(program)
+    assert profiler.leaks == [(start, 3, 0, 1), (start+3, 1, 2, 2)]
+    assert profiler.events() == [(3, "PUSH", 4, start+4, 1, 5), (4, "FREE", 6, start+4, 1, 4)]
+    assert profiler.peak == 5
@@ -0,0 +1,103 @@
+import hc
+import vm
+
+from components.hooks import Tracer
+from components.instructions import dispatch
+from compiler.instructions import Instruction
+
+hatch = """
+import io;
+
+function int triangle_number(int n) {
+    if (n == 1) {
+        return 1;
+    } else {
+        return n + triangle_number(n-1);
+    }
+}
+
+function int main() {
+    io.print(triangle_number(3));
+}
+"""
+
+class RecordingTracer(Tracer):
+    def __init__(self):
+        self.instructions = 0
+        self.writes = []
+        self.pushes = []
+        self.frees = []
+        self.calls = []
+        self.rets = []
+
+    def on_instruction(self, emulator, address, instruction, data):
+        self.instructions += 1
+
+    def on_memory_write(self, emulator, address, value):
+        self.writes.append((address, value))
+
+    def on_push(self, emulator, address, length):
+        self.pushes.append((address, length))
+
+    def on_free(self, emulator, address, length):
+        self.frees.append((address, length))
+
+    def on_call(self, emulator, return_address, target):
+        self.calls.append((return_address, target))
+
+    def on_ret(self, emulator, return_address):
+        self.rets.append(return_address)
+
+def test_hooks():
+    instructions = hc.compile(hatch)
+
+    tracer = RecordingTracer()
+    traced = vm.OctoEngine(True, tracers=[tracer])
+    traced.load(instructions)
+
+    untraced = vm.OctoEngine(True)
+    untraced.load(instructions)
+    assert untraced.dispatch is dispatch
+
+    assert traced.run() == untraced.run() == [6,]
+    assert tracer.instructions > 0
+    assert len(tracer.calls) == len(tracer.rets) == 4
+    assert sorted(return_address for return_address, target in tracer.calls) == sorted(tracer.rets)
+    assert len(tracer.pushes) > 0
+    assert len(tracer.frees) > 0
+    assert all(0 <= value <= 255 for address, value in tracer.writes)
+
+def test_remove_tracer():
+    tracer = RecordingTracer()
+    virtual_machine = vm.OctoEngine(True)
+    virtual_machine.add_tracer(tracer)
+    virtual_machine.remove_tracer(tracer)
+    assert virtual_machine.dispatch is dispatch
+
+class MirrorTracer(Tracer):
+    """Keeps a copy of memory up to date from on_memory_write alone."""
+    def __init__(self, memory):
+        self.memory = bytearray(memory)
+
+    def on_memory_write(self, emulator, address, value):
+        self.memory[address] = value
+
+def test_memory_writes():
+    program = [
+        Instruction.PUSH.value, 1,
+        Instruction.PUSH.value, 1,
+        Instruction.LDA.value, 7,
+        Instruction.STA.value | 0b0100_0000, 1,
+        Instruction.DUP.value, 2,
+        Instruction.FREE.value, 1,              # leaves a gap below the second byte
+        Instruction.PUSH.value, 0,              # size set below, only fits once the second byte has moved down
+        Instruction.HLT.value, 0,
+    ]
+    program[-3] = 256 - 16 - len(program) - 1
+    virtual_machine = vm.OctoEngine(True)
+    virtual_machine.load(program)
+    tracer = MirrorTracer(virtual_machine.memory.memory)
+    virtual_machine.add_tracer(tracer)
+    virtual_machine.run()
+    assert virtual_machine.heap.stats["compactions"] == 1
+    assert tracer.memory[:240] == virtual_machine.memory.memory[:240]
@@ -0,0 +1,27 @@
+import vm
+
+from compiler.instructions import Instruction
+from components.image import ProgramImage
+
+program = [
+    Instruction.LDA.value, 42,
+    Instruction.STA.value, 7,   # overwrite the data byte of the PRX below
+    Instruction.NOP.value, 0,
+    Instruction.PRX.value, 5,
+    Instruction.HLT.value, 0,
+]
+
+def test_image():
+    image = ProgramImage(program)
+    first = vm.OctoEngine(True)
+    first.load(image)
+    second = vm.OctoEngine(True)
+    second.load(image)
+    assert first.decoded[6] is second.decoded[6]
+
+    assert first.run() == [42]
+    # The store only changed the first engine's memory
+    assert image.code[7] == 5
+    assert second.memory[7] == 5
+    assert second.decoded[6][3] == 5
+    assert second.run() == [42]
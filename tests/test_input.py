@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+import hc
+import vm
+
+from components.input import InputException
+
+hatch = """
+import io;
+
+function void main() {
+    io.print(io.read_int() + 1);
+}
+"""
+
+def test_input_bytes():
+    virtual_machine = vm.OctoEngine(True, input_source=b"41\n")
+    virtual_machine.load(hc.compile(hatch))
+    assert virtual_machine.run() == [42]
+
+def test_input_pipe():
+    read_end, write_end = os.pipe()
+    os.write(write_end, b"99\n")
+    os.close(write_end)
+    virtual_machine = vm.OctoEngine(True, input_source=read_end)
+    virtual_machine.load(hc.compile(hatch))
+    assert virtual_machine.run() == [100]
+    os.close(read_end)
+
+def test_feed():
+    virtual_machine = vm.OctoEngine(True, input_source=b"1")
+    virtual_machine.load(hc.compile(hatch))
+    with pytest.raises(InputException):
+        virtual_machine.run()
+    virtual_machine.feed(b"2\n")
+    assert virtual_machine.run() == [13]
+
+def test_feed_cycles():
+    whole = vm.OctoEngine(True, input_source=b"12\n")
+    whole.load(hc.compile(hatch))
+    whole.run()
+    # A READ left to run again is only counted once, so the same limit is enough
+    for jit in (False, True):
+        virtual_machine = vm.OctoEngine(True, jit=jit, input_source=b"1", max_cycles=whole.cycles)
+        virtual_machine.load(hc.compile(hatch))
+        for i in range(0, 3):
+            with pytest.raises(InputException):
+                virtual_machine.run()
+        virtual_machine.feed(b"2\n")
+        assert virtual_machine.run() == [13]
+        assert virtual_machine.cycles == whole.cycles
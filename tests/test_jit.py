@@ -0,0 +1,126 @@
+import pytest
+import hc
+import vm
+
+from compiler.instructions import Instruction
+
+hatch = """
+import algorithm;
+
+function void main() {
+    let int[7] numbers = [7, 6, 5, 4, 3, 2, 1];
+    algorithm.sort(numbers);
+    let int x = numbers[0];
+    __internal_print(x);
+    x = numbers[6];
+    __internal_print(x);
+}
+"""
+
+def test_jit():
+    instructions = hc.compile(hatch)
+
+    interpreted = vm.OctoEngine(True)
+    interpreted.load(instructions)
+
+    compiled = vm.OctoEngine(True, jit=True)
+    compiled.jit.hot_threshold = 1
+    compiled.jit.warmup = 0
+    compiled.load(instructions)
+
+    assert interpreted.run() == compiled.run() == [1, 7]
+    assert interpreted.memory.memory == compiled.memory.memory
+    assert interpreted.stack[:interpreted.sp] == compiled.stack[:compiled.sp]
+    assert any(compiled.jit.blocks)
+
+def test_jit_invalidate():
+    instructions = hc.compile(hatch)
+
+    virtual_machine = vm.OctoEngine(True, jit=True)
+    virtual_machine.load(instructions)
+    virtual_machine.jit.compile(0)
+    assert virtual_machine.jit.blocks[0]
+
+    virtual_machine.memory[1] = virtual_machine.memory[1]
+    assert virtual_machine.jit.blocks[0] is None
+
+
+def test_jit_self_modifying_loop():
+    program = [
+        Instruction.LDA.value, 3,
+        Instruction.STA.value, 7,   # overwrite the data byte of the PRX below
+        Instruction.NOP.value, 0,
+        Instruction.PRX.value, 0,
+        Instruction.DEC.value, 255,
+        Instruction.LDB.value, 0,
+        Instruction.CMP.value, 0,
+        Instruction.JNE.value, 2,
+        Instruction.HLT.value, 0,
+    ]
+    virtual_machine = vm.OctoEngine(True, jit=True)
+    virtual_machine.jit.hot_threshold = 1
+    virtual_machine.jit.warmup = 0
+    virtual_machine.load(program)
+    assert virtual_machine.run() == [3, 2, 1]
+
+def test_jit_register_addresses():
+    mem = 0b1000_0000
+    stack = 0b0100_0000
+    loop = [
+        Instruction.INC.value, 253,
+        Instruction.MOV.value, 0b0000_0010,     # A = counter
+        Instruction.LDB.value, 3,
+        Instruction.CMP.value, 0,
+        Instruction.JNE.value, 2,
+        Instruction.HLT.value, 0,
+    ]
+    # Registers read through a runtime address, and stepped through one
+    read = [
+        Instruction.LDB.value, 9,
+        Instruction.LDA.value | mem, 254,       # A = B, at reg_offset + 254
+        Instruction.PRX.value | mem, 255,
+    ]
+    read += loop
+    read[-3] = 0
+    step = [
+        Instruction.PUSH.value, 1,
+        Instruction.OFF.value, 0,
+        Instruction.LDB.value, 5,
+        Instruction.INC.value | stack, 1,       # B += 1, the pushed address + reg_offset is 254
+        Instruction.PRX.value | mem, 254,
+        Instruction.OFF.value, 0,
+    ]
+    step += loop
+    step[-3] = 2
+    step[3] = 254 - len(step)
+    for program, expected in ((read, [9, 9, 9]), (step, [6, 6, 6])):
+        interpreted = vm.OctoEngine(True)
+        interpreted.load(program)
+        compiled = vm.OctoEngine(True, jit=True)
+        compiled.jit.hot_threshold = 1
+        compiled.jit.warmup = 0
+        compiled.load(program)
+        assert interpreted.run() == compiled.run() == expected
+
+def test_jit_exception_state():
+    # Registers a handler changed before raising, the instruction register and cycles are left as the interpreter leaves them
+    sets_counter = [19, 15, 9, 253, 18, 113, 23, 4, 6, 109, 193, 2, 17, 4, 19, 2, 213, 3, 15, 6, 6, 0]
+    sets_func = [
+        Instruction.LDA.value, 5,
+        Instruction.RET.value, 7,           # call stack underflow after reg_func is set
+    ]
+    for program in (sets_counter, sets_func):
+        engines = [vm.OctoEngine(True), vm.OctoEngine(True, jit=True)]
+        engines[1].jit.hot_threshold = 1
+        engines[1].jit.warmup = 0
+        states = []
+        for engine in engines:
+            engine.load(program)
+            with pytest.raises(Exception) as error:
+                engine.run()
+            states.append((
+                type(error.value), engine.reg_a, engine.reg_b, engine.reg_counter, engine.reg_func, engine.reg_offset,
+                engine.instruction_register, engine.cycles, engine.sp, bytes(engine.stack), engine.memory.memory,
+            ))
+        assert any(engines[1].jit.blocks)
+        assert states[0] == states[1]
@@ -0,0 +1,63 @@
+import pytest
+
+import hc
+import vm
+
+from compiler.instructions import Instruction
+from components.limits import LimitException
+from components.runner import run_batch
+
+hatch = """
+import io;
+
+function int triangle_number(int n) {
+    if (n == 1) {
+        return 1;
+    } else {
+        return n + triangle_number(n-1);
+    }
+}
+
+function int main() {
+    io.print(triangle_number(5));
+}
+"""
+
+def test_usage():
+    virtual_machine = vm.OctoEngine(True)
+    virtual_machine.load(hc.compile(hatch))
+    assert virtual_machine.run() == [15]
+    usage = virtual_machine.usage
+    # Five nested triangle_number calls, main is jumped to
+    assert usage["call_depth"] == 5
+    assert usage["heap_peak"] > 0
+    assert usage["cycles"] > 0
+
+    limits = [("max_cycles", "cycles", "Cycle"), ("max_heap", "heap_peak", "Heap"), ("max_call_depth", "call_depth", "Call depth")]
+    for limit, counter, resource in limits:
+        for jit in (False, True):
+            limited = vm.OctoEngine(True, jit=jit, **{limit: usage[counter] - 1})
+            limited.load(hc.compile(hatch))
+            with pytest.raises(LimitException) as error:
+                limited.run()
+            assert error.value.resource == resource
+
+    exact = vm.OctoEngine(True, max_cycles=usage["cycles"], max_heap=usage["heap_peak"], max_call_depth=usage["call_depth"])
+    exact.load(hc.compile(hatch))
+    assert exact.run() == [15]
+
+def test_runaway_loop():
+    program = [
+        Instruction.JMP.value, 0,
+    ]
+    for jit in (False, True):
+        virtual_machine = vm.OctoEngine(True, jit=jit, max_cycles=1000)
+        virtual_machine.load(program)
+        with pytest.raises(LimitException):
+            virtual_machine.run()
+        assert virtual_machine.cycles == 1000
+
+def test_batch_limits():
+    results = list(run_batch(bytes(hc.compile(hatch)), [b"", b""], jobs=1, limits={"max_call_depth": 3}))
+    assert all(isinstance(result.error, LimitException) for result in results)
+    assert results[0].call_depth == 3
@@ -0,0 +1,21 @@
+import vm
+
+from compiler.instructions import Instruction
+
+program = [
+    Instruction.LDA.value, 42,
+    Instruction.STA.value, 200,
+    Instruction.PRX.value | 0b1000_0000, 255,   # register A through its reserved address
+    Instruction.HLT.value, 0,
+]
+
+def test_memory():
+    virtual_machine = vm.OctoEngine(True)
+    virtual_machine.load(program)
+    assert isinstance(virtual_machine.memory.memory, bytearray)
+    assert virtual_machine.memory[2] == Instruction.STA.value
+
+    assert virtual_machine.run() == [42]
+    assert virtual_machine.reg_a == 42
+    assert virtual_machine.memory[200] == 42
+    assert virtual_machine.memory[255] == 42
@@ -0,0 +1,87 @@
+import contextlib
+import io
+import os
+
+import pytest
+
+import hc
+import vm
+
+from components.output import BufferedSink, BytesSink, FileSink
+
+hatch = """
+import io;
+
+function void main() {
+    io.print(12);
+    io.print("Hi");
+}
+"""
+
+def test_bytes_sink():
+    sink = BytesSink()
+    virtual_machine = vm.OctoEngine(True, sinks=[sink])
+    virtual_machine.load(hc.compile(hatch))
+    assert virtual_machine.run() == []
+    assert sink.data == b"12\nHi\n"
+
+def test_file_sink():
+    read_end, write_end = os.pipe()
+    virtual_machine = vm.OctoEngine(True, sinks=[FileSink(write_end)])
+    virtual_machine.load(hc.compile(hatch))
+    virtual_machine.run()
+    os.close(write_end)
+    with os.fdopen(read_end, "rb") as pipe:
+        assert pipe.read() == b"12\nHi\n"
+
+def test_flush_before_read():
+    prompt = """
+import io;
+
+function void main() {
+    io.print(12);
+    io.print(io.read_int() + 1);
+}
+"""
+    read_end, write_end = os.pipe()
+    os.set_blocking(read_end, False)
+    seen = []
+
+    class Source:
+        # Stands in for a terminal, the prompt has to be out before it answers
+        def read(self, size):
+            seen.append(os.read(read_end, 100))
+            return b"41\n"
+
+    virtual_machine = vm.OctoEngine(True, sinks=[FileSink(write_end)], input_source=Source())
+    virtual_machine.load(hc.compile(prompt))
+    virtual_machine.run()
+    os.close(write_end)
+    os.close(read_end)
+    assert seen == [b"12\n"]
+
+def test_buffered_sink_is_abstract():
+    with pytest.raises(TypeError):
+        BufferedSink()
+
+def test_stdout_sink(capsys):
+    virtual_machine = vm.OctoEngine(False)
+    virtual_machine.load(hc.compile(hatch))
+    capsys.readouterr()
+    print("before")
+    virtual_machine.run()
+    print("after")
+    assert capsys.readouterr().out == "before\n12\nHi\nafter\n"
+
+def test_stdout_sink_redirected():
+    virtual_machine = vm.OctoEngine(False)
+    virtual_machine.load(hc.compile(hatch))
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        virtual_machine.run()
+    assert output.getvalue() == "12\nHi\n"
+
+def test_stream():
+    virtual_machine = vm.OctoEngine(True)
+    virtual_machine.load(hc.compile(hatch))
+    assert list(virtual_machine.stream()) == [b"12", b"\n", b"H", b"i", b"\n"]
+    assert virtual_machine.output == [12, "H", "i"]
@@ -0,0 +1,55 @@
+import pytest
+
+import vm
+
+from compiler.instructions import Instruction
+from components.paging import PageCache
+
+mem = 0b1000_0000
+banks = 12
+
+program = []
+for bank in range(0, banks):
+    program += [Instruction.LDA.value, bank + 100, Instruction.BANK.value, bank, Instruction.STA.value, 239]
+for bank in reversed(range(0, banks)):
+    program += [Instruction.BANK.value, bank, Instruction.PRX.value | mem, 239]
+program += [Instruction.HLT.value, 0]
+
+expected = [bank + 100 for bank in reversed(range(0, banks))]
+
+def test_paging(tmp_path):
+    for jit in (False, True):
+        for policy in ("lru", "clock"):
+            for path in (None, tmp_path / "pages"):
+                # A window of 16 byte pages per bank, but only room for 4 pages in the cache
+                pages = PageCache(frames=4, page_size=16, path=path, policy=policy)
+                virtual_machine = vm.OctoEngine(True, jit=jit, banks=banks, pages=pages)
+                virtual_machine.load(program)
+                assert virtual_machine.run() == expected
+                stats = pages.stats()
+                assert stats["store_reads"] > 0 and stats["evictions"] > 0 and stats["writebacks"] > 0
+                assert 0 <= pages.cache_read_rate < 1
+                pages.close()
+
+def test_paging_cached():
+    # With room for every page, switching back to a bank finds its pages cached
+    pages = PageCache(frames=1024)
+    virtual_machine = vm.OctoEngine(True, banks=banks, pages=pages)
+    virtual_machine.load(program)
+    virtual_machine.run()
+    assert pages.evictions == 0
+    assert pages.cache_reads > 0
+
+def test_paging_snapshot():
+    flat = vm.OctoEngine(True, banks=banks)
+    flat.load(program)
+    flat.run_cycles(banks * 3)
+    paged = vm.OctoEngine(True, banks=banks, pages=PageCache(frames=2))
+    paged.load(program)
+    paged.run_cycles(banks * 3)
+    assert paged.snapshot().to_bytes() == flat.snapshot().to_bytes()
+    assert paged.fork().run() == flat.fork().run() == expected
+
+def test_policy():
+    with pytest.raises(ValueError):
+        PageCache(policy="fifo")
@@ -0,0 +1,18 @@
+import vm
+
+from compiler.instructions import Instruction
+
+program = [
+    Instruction.LDA.value, 42,
+    Instruction.STA.value, 7,   # overwrite the data byte of the PRX below
+    Instruction.NOP.value, 0,
+    Instruction.PRX.value, 5,
+    Instruction.HLT.value, 0,
+]
+
+def test_predecode():
+    virtual_machine = vm.OctoEngine(True)
+    virtual_machine.load(program)
+    assert virtual_machine.decoded[6] is not None
+    output = virtual_machine.run()
+    assert output == [42,]
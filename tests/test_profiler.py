@@ -0,0 +1,40 @@
+import hc
+import vm
+
+hatch = """
+import io;
+
+function int triangle_number(int n) {
+    if (n == 1) {
+        return 1;
+    } else {
+        return n + triangle_number(n-1);
+    }
+}
+
+function int main() {
+    io.print(triangle_number(3));
+}
+"""
+
+def test_profiler():
+    instructions, function_addresses, data_start = hc.compile(hatch, debug=True)
+
+    virtual_machine = vm.OctoEngine(True)
+    virtual_machine.load(instructions)
+    profiler = virtual_machine.profile(function_addresses)
+    assert virtual_machine.run() == [6,]
+
+    assert profiler.cycles == sum(profiler.opcodes) == sum(profiler.addresses) == virtual_machine.cycles
+    assert sum(profiler.addresses[data_start:]) == 0
+    functions = profiler.functions()
+    assert functions["main"][0] == profiler.cycles
+    assert sum(exclusive for inclusive, exclusive in functions.values()) == profiler.cycles
+    # Recursive calls are counted once in the inclusive cycles
+    assert functions["triangle_number"][0] == functions["triangle_number"][1]
+    assert functions["io.print"][0] == functions["io.print"][1] > 0
+
+    folded = profiler.folded().splitlines()
+    assert "main;triangle_number;triangle_number;triangle_number" in [line.rsplit(" ", 1)[0] for line in folded]
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in folded) == profiler.cycles
+    assert profiler.table(2).splitlines()[1].startswith("triangle_number")
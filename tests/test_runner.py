@@ -0,0 +1,46 @@
+import os
+
+import hc
+
+from components.input import InputException
+from components.runner import run_batch, load_program, load_image, BatchRunner, IMAGE_CACHE_SIZE
+
+hatch = """
+import io;
+
+function void main() {
+    io.print(io.read_int() * 2);
+}
+"""
+
+def test_run_batch():
+    program = bytes(hc.compile(hatch))
+    inputs = [b"%d\n" % i for i in range(0, 40)] + [b""]
+    results = list(run_batch(program, inputs, jobs=2, chunksize=4))
+    assert [result.output for result in results[:-1]] == [[i*2 % 256] for i in range(0, 40)]
+    assert results[3].printed == b"6\n"
+    assert all(result.halted and result.cycles > 0 for result in results[:-1])
+    assert isinstance(results[-1].error, InputException)
+
+def test_batch_runner_in_process():
+    program = bytes(hc.compile(hatch))
+    runner = BatchRunner(jobs=1)
+    results = list(runner.run([(program, b"5\n"), (program, b"6\n")]))
+    assert [result.output for result in results] == [[10], [12]]
+    assert runner.stats.runs == 2
+    assert runner.stats.cycles == sum(result.cycles for result in results)
+
+def test_load_program(tmp_path):
+    program = bytes(hc.compile(hatch))
+    assert load_program(program) is load_program(bytearray(program))
+    path = tmp_path / "program.hb"
+    path.write_bytes(program)
+    image = load_program(str(path))
+    assert load_program(str(path)) is image
+    # Rewritten since, so it is loaded again
+    path.write_bytes(program + bytes(2))
+    os.utime(path, ns=(0, 0))
+    assert load_program(str(path)) is not image
+    for i in range(0, IMAGE_CACHE_SIZE + 1):
+        load_program(program + bytes([i, 0]))
+    assert load_image.cache_info().currsize == IMAGE_CACHE_SIZE
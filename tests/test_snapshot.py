@@ -0,0 +1,53 @@
+import pytest
+
+import hc
+import vm
+
+from components.input import InputException
+from components.snapshot import Snapshot
+
+hatch = """
+import io;
+
+function void main() {
+    let int[3] numbers = [1, 2, 3];
+    io.print(numbers[2]);
+    let int x = io.read_int();
+    io.print(x + numbers[1]);
+}
+"""
+
+def warmed_up():
+    virtual_machine = vm.OctoEngine(True, input_source=b"")
+    virtual_machine.load(hc.compile(hatch))
+    # Runs up to the first READ
+    with pytest.raises(InputException):
+        virtual_machine.run()
+    return virtual_machine
+
+def test_fork():
+    virtual_machine = warmed_up()
+    assert virtual_machine.output == [3]
+
+    for i in range(0, 5):
+        child = virtual_machine.fork()
+        child.feed(f"{i}\n".encode())
+        assert child.run() == [3, i+2]
+    assert virtual_machine.output == [3]
+    assert not virtual_machine.halted
+
+def test_snapshot_bytes():
+    virtual_machine = warmed_up()
+    virtual_machine.feed(b"4")
+    data = virtual_machine.snapshot().to_bytes()
+    snapshot = Snapshot.from_bytes(data)
+    assert snapshot.to_bytes() == data
+
+    restored = vm.OctoEngine(True, input_source=b"")
+    restored.restore(snapshot)
+    restored.feed(b"0\n")
+    assert restored.run() == [3, 42]
+
+    virtual_machine.restore(snapshot)
+    virtual_machine.feed(b"1\n")
+    assert virtual_machine.run() == [3, 43]
@@ -0,0 +1,58 @@
+import pytest
+
+import vm
+
+from compiler.instructions import Instruction
+from components.stack import StackException
+from components.hooks import Tracer
+
+def test_stack_overflow():
+    program = [
+        Instruction.PUSH.value, 1,
+        Instruction.DUP.value, 1,
+        Instruction.JMP.value, 2,
+    ]
+    virtual_machine = vm.OctoEngine(True, stack_size=16)
+    virtual_machine.load(program)
+    with pytest.raises(StackException):
+        virtual_machine.run()
+    assert virtual_machine.sp == 16
+
+def test_call_stack_overflow():
+    program = [
+        Instruction.CALL.value, 0,
+    ]
+    virtual_machine = vm.OctoEngine(True)
+    virtual_machine.load(program)
+    with pytest.raises(StackException):
+        virtual_machine.run()
+    assert virtual_machine.call_sp == len(virtual_machine.call_stack)
+
+def test_stack_underflow():
+    program = [
+        Instruction.PUSH.value, 1,
+        Instruction.POP.value, 2,
+    ]
+    virtual_machine = vm.OctoEngine(True)
+    virtual_machine.load(program)
+    with pytest.raises(StackException):
+        virtual_machine.run()
+    assert virtual_machine.sp == 1
+
+@pytest.mark.parametrize("operand", [
+    [Instruction.LDA.value | 0b0100_0000, 3],   # below the bottom
+    [Instruction.LDA.value | 0b0100_0000, 0],   # above the top
+    [Instruction.STA.value | 0b0100_0000, 2],
+    [Instruction.PRX.value | 0b0100_0000, 2],
+    [Instruction.DUP.value, 2],
+])
+def test_stack_operand_underflow(operand):
+    program = [Instruction.PUSH.value, 1] + operand + [Instruction.HLT.value, 0]
+    for jit, tracers in ((False, ()), (True, ()), (False, [Tracer()])):
+        virtual_machine = vm.OctoEngine(True, jit=jit, tracers=tracers)
+        virtual_machine.load(program)
+        if jit:
+            virtual_machine.jit.compile(0)
+        with pytest.raises(StackException):
+            virtual_machine.run()
+        assert virtual_machine.sp == 1
@@ -0,0 +1,46 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import hc
+import vm
+
+from components.image import ProgramImage
+from components.runner import run_batch
+
+hatch = """
+import io;
+
+function int fib(int n) {
+    if (n < 2) {
+        return n;
+    }
+    return fib(n - 1) + fib(n - 2);
+}
+
+function void main() {
+    let int n = io.read_int();
+    io.print(fib(n));
+}
+"""
+
+def fib(n):
+    return n if n < 2 else fib(n - 1) + fib(n - 2)
+
+def test_threaded_engines():
+    image = ProgramImage(hc.compile(hatch))
+
+    def run(n):
+        # Interpreted and compiled engines sharing one image
+        virtual_machine = vm.OctoEngine(True, jit=n % 2 == 0, input_source=b"%d\n" % (n % 12))
+        virtual_machine.load(image)
+        return virtual_machine.run()
+
+    expected = [[fib(n % 12) % 256] for n in range(0, 64)]
+    with ThreadPoolExecutor(8) as executor:
+        for repeat in range(0, 3):
+            assert list(executor.map(run, range(0, 64))) == expected
+
+def test_thread_runner():
+    program = bytes(hc.compile(hatch))
+    inputs = [b"%d\n" % (n % 12) for n in range(0, 64)]
+    results = list(run_batch(program, inputs, jobs=8, threads=True))
+    assert [result.output for result in results] == [[fib(n % 12) % 256] for n in range(0, 64)]
@@ -0,0 +1,39 @@
+import pytest
+
+import vm
+
+from compiler.instructions import Instruction
+from components.trace import decode_trace
+from tracedump import format_trace
+
+program = [
+    Instruction.LDA.value, 0,
+    Instruction.INC.value, 255,
+    Instruction.LDB.value, 5,
+    Instruction.CMP.value, 0,
+    Instruction.JL.value, 2,
+    Instruction.LDB.value, 0,
+    Instruction.DIV.value, 0,
+    Instruction.HLT.value, 0,
+]
+
+def test_trace(tmp_path):
+    for path in (None, str(tmp_path / "trace.bin")):
+        virtual_machine = vm.OctoEngine(True)
+        virtual_machine.load(program)
+        recorder = virtual_machine.record_trace(capacity=8, path=path)
+        with pytest.raises(ZeroDivisionError):
+            virtual_machine.run()
+        data = recorder.to_bytes()
+        recorder.close()
+        if path is not None:
+            with open(path, "rb") as trace_file:
+                assert trace_file.read() == data
+
+        records = decode_trace(data)
+        assert len(records) == 8
+        assert [record[0] for record in records] == list(range(virtual_machine.cycles - 7, virtual_machine.cycles + 1))
+        # The last record is the instruction that raised
+        cycle, address, instruction, data_byte, reg_a, reg_b, reg_offset, depth = records[-1]
+        assert (address, instruction, reg_a, reg_b) == (12, Instruction.DIV.value, 5, 0)
+        assert format_trace(data, 2).splitlines()[-1].split()[1:3] == ["12:", "DIV"]
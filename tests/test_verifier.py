@@ -0,0 +1,93 @@
+import pytest
+
+import hc
+import vm
+
+from compiler.instructions import Instruction
+from components.image import ProgramImage
+from components.instructions import STA_unchecked
+from components.stack import STACK_SIZE
+from components.verifier import verify, VerifyException
+
+mem = 0b1000_0000
+stack = 0b0100_0000
+
+hatch = """
+import io;
+
+function int triangle_number(int n) {
+    let int total = 0;
+    for (let int i=1; i<=n; i=i+1) {
+        total = total + i;
+    }
+    return total;
+}
+
+function void main() {
+    io.print(triangle_number(10));
+}
+"""
+
+def test_verified():
+    instructions = hc.compile(hatch)
+    for jit in (False, True):
+        virtual_machine = vm.OctoEngine(True, jit=jit, verify=True)
+        virtual_machine.load(instructions)
+        assert virtual_machine.run() == [55]
+
+def test_unchecked_store():
+    program = [
+        Instruction.LDA.value, 7,
+        Instruction.STA.value, 200,
+        Instruction.PRX.value | mem, 200,
+        Instruction.HLT.value, 0,
+    ]
+    image = ProgramImage(program)
+    assert verify(image) == [0, 2, 4, 6]
+    virtual_machine = vm.OctoEngine(True, verify=True)
+    virtual_machine.load(image)
+    assert virtual_machine.decoded[2][0] is STA_unchecked
+    assert virtual_machine.run() == [7]
+
+@pytest.mark.parametrize("program", [
+    [Instruction.JMP.value, 3, Instruction.HLT.value, 0],                       # jump into the middle of an instruction
+    [Instruction.CALL.value, 200, Instruction.HLT.value, 0],                    # call outside the program
+    [Instruction.JMP.value | mem, 200, Instruction.HLT.value, 0],               # computed jump
+    [Instruction.LDA.value, 1, Instruction.STA.value, 0, Instruction.HLT.value, 0],  # store to the program
+    [Instruction.STA.value, 245, Instruction.HLT.value, 0],                     # store to a reserved address
+    [Instruction.LDA.value | stack, 0, Instruction.HLT.value, 0],               # stack operand above the top
+    [Instruction.MOV.value, 0b1111_0000, Instruction.HLT.value, 0],             # no such register
+    [Instruction.BANK.value, 1, Instruction.HLT.value, 0],                      # no such bank
+    [Instruction.LDA.value, 1],                                                 # runs off the end
+    [Instruction.HLT.value],                                                    # half an instruction
+])
+def test_rejected(program):
+    virtual_machine = vm.OctoEngine(True, verify=True)
+    with pytest.raises(VerifyException):
+        virtual_machine.load(program)
+    # Unverified engines still run them and fail, or not, as they go
+    vm.OctoEngine(True).load(program)
+
+def test_data_is_not_checked():
+    # Bytes after the HLT are never run
+    program = [Instruction.HLT.value, 0, 0b1111_1111, 3]
+    verify(ProgramImage(program))
+
+def test_rejected_load_keeps_program():
+    virtual_machine = vm.OctoEngine(True, verify=True)
+    virtual_machine.load(hc.compile(hatch))
+    memory = bytes(virtual_machine.memory.memory)
+    decoded = list(virtual_machine.decoded)
+    with pytest.raises(VerifyException):
+        virtual_machine.load([Instruction.JMP.value | mem, 200, Instruction.HLT.value, 0])
+    assert bytes(virtual_machine.memory.memory) == memory
+    assert virtual_machine.decoded == decoded
+    assert virtual_machine.run() == [55]
+
+def test_verified_once():
+    image = ProgramImage([Instruction.STA.value, 100, Instruction.HLT.value, 0])
+    for i in range(0, 3):
+        vm.OctoEngine(True, verify=True).load(image)
+    vm.OctoEngine(True, verify=True, harvard=True).load(image)
+    # One result per engine setup, each run through the checks once
+    assert list(image.verified) == [(1, STACK_SIZE, False), (1, STACK_SIZE, True)]
@@ -0,0 +1,112 @@
+from components.limits import LimitException
+
+class OutOfMemoryException(Exception):
+    pass
+
+def bit_count(bits):
+    # int.bit_count() needs Python 3.10
+    return bin(bits).count("1")
+
+class BitmapAllocator:
+    """
+    First fit heap allocator. Occupied bytes are the set bits of a single int,
+    so finding a free run of n bytes is a handful of shifts and ands over the
+    whole heap instead of a scan over every address.
+    """
+    __slots__ = ("start", "end", "heap", "occupied", "compactions", "bytes_moved", "peak", "limit")
+
+    def __init__(self, start=0, end=0, limit=None):
+        # Most bytes that may be occupied at once, None for the whole heap
+        self.limit = limit
+        self.reset(start, end)
+
+    def reset(self, start, end):
+        # Heap covers addresses start <= address < end
+        self.start = start
+        self.end = end
+        self.heap = ((1 << end) - 1) ^ ((1 << start) - 1) if end > start else 0
+        self.occupied = 0
+        self.compactions = 0
+        self.bytes_moved = 0
+        # High water mark of occupied bytes
+        self.peak = 0
+
+    def allocate(self, length):
+        """Mark the first free run of length bytes as occupied and return its address."""
+        # Zero length allocations still take a byte so each one gets its own address
+        length = max(length, 1)
+        runs = self.heap & ~self.occupied
+        # Keep only the bits that start a free run of at least length bytes
+        covered = 1
+        while covered * 2 <= length:
+            runs &= runs >> covered
+            covered *= 2
+        if covered < length:
+            runs &= runs >> (length - covered)
+        if not runs:
+            raise OutOfMemoryException("Out of memory")
+        address = (runs & -runs).bit_length() - 1
+        occupied = self.occupied | ((1 << length) - 1) << address
+        used = bit_count(occupied)
+        if used > self.peak:
+            if self.limit is not None and used > self.limit:
+                raise LimitException("Heap", self.limit)
+            self.peak = used
+        self.occupied = occupied
+        return address
+
+    def free(self, address, length=1):
+        """Mark length bytes from address as free, they need not have been allocated together."""
+        if length > 0:
+            self.occupied &= ~(((1 << length) - 1) << address)
+
+    def is_free(self, address):
+        return not (self.occupied >> address) & 1
+
+    @property
+    def free_bytes(self):
+        return bit_count(self.heap & ~self.occupied)
+
+    @property
+    def live_bytes(self):
+        return bit_count(self.heap & self.occupied)
+
+    @property
+    def largest_free_run(self):
+        runs = self.heap & ~self.occupied
+        length = 0
+        # Each shift and and shortens every run by one, so this counts down the longest
+        while runs:
+            runs &= runs >> 1
+            length += 1
+        return length
+
+    def compact(self):
+        """
+        Slide every run of occupied bytes down to the lowest free address,
+        leaving all the free space in one run at the top of the heap.
+        Returns the (address, destination, length) moves in address order,
+        the caller is responsible for moving the bytes and the pointers.
+        """
+        moves = []
+        destination = self.start
+        address = self.start
+        while address < self.end:
+            if self.is_free(address):
+                address += 1
+                continue
+            length = 1
+            while address + length < self.end and not self.is_free(address + length):
+                length += 1
+            if address != destination:
+                moves.append((address, destination, length))
+                self.bytes_moved += length
+            destination += length
+            address += length
+        self.occupied = ((1 << destination) - 1) ^ ((1 << self.start) - 1)
+        self.compactions += 1
+        return moves
+
+    @property
+    def stats(self):
+        return {"compactions": self.compactions, "bytes_moved": self.bytes_moved, "free_bytes": self.free_bytes, "peak": self.peak}
@@ -0,0 +1,467 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from components.memory import MemoryAccessException, HEAP_END
+from components.register import RegisterException, REGISTER_START
+from components.allocator import OutOfMemoryException
+from components.stack import STACK_SIZE, CALL_STACK_SIZE, overflow, underflow
+from components.input import InputException
+from components.image import ProgramImage
+from components.instructions import is_bank_select
+from components.snapshot import NUMBER, CHAR
+
+# Columns of BatchEngine.registers, register address 255 - column
+A, B, COUNTER, IR, FUNC, OFFSET = range(0, 6)
+
+class BatchEngine:
+    """
+    Runs one program over many inputs in lockstep. Each lane is a whole
+    machine, held as a row of NumPy arrays (memory, registers, stacks, heap
+    bitmap, input), and every cycle each running lane executes one
+    instruction. Lanes are grouped by the instruction they are at, so while
+    they agree an instruction runs once for all of them, and lanes that
+    diverge on a conditional jump are simply in different groups.
+
+    Output, halting and errors per lane match running each input through its
+    own OctoEngine. A lane that raises stops, and the exception is kept in
+    errors rather than raised.
+    """
+    def __init__(self, program, inputs, stack_size=STACK_SIZE, call_stack_size=CALL_STACK_SIZE):
+        if np is None:
+            raise ImportError("BatchEngine needs numpy")
+        image = program if isinstance(program, ProgramImage) else ProgramImage(program)
+        if image.data:
+            raise MemoryAccessException("BatchEngine has no Harvard mode, the program's data can't be loaded")
+        self.program_end = image.program_end
+        lanes = len(inputs)
+        self.lanes = lanes
+
+        self.memory = np.zeros((lanes, 256), dtype=np.uint8)
+        self.memory[:, :image.program_end] = np.frombuffer(image.code, dtype=np.uint8)
+        self.registers = np.zeros((lanes, 6), dtype=np.int64)
+        self.comparison = np.zeros(lanes, dtype=np.int64)
+
+        self.stack = np.zeros((lanes, stack_size), dtype=np.int64)
+        self.sp = np.zeros(lanes, dtype=np.int64)
+        self.call_stack = np.zeros((lanes, call_stack_size), dtype=np.int64)
+        self.call_sp = np.zeros(lanes, dtype=np.int64)
+        # Stack depths of the register pairs pushed by SAVE, as OctoEngine.saved
+        self.saved = np.zeros((lanes, stack_size), dtype=np.int64)
+        self.saved_count = np.zeros(lanes, dtype=np.int64)
+
+        self.occupied = np.zeros((lanes, 256), dtype=bool)
+        self.compactions = np.zeros(lanes, dtype=np.int64)
+        self.bytes_moved = np.zeros(lanes, dtype=np.int64)
+
+        length = max([len(data) for data in inputs] + [1])
+        self.input = np.zeros((lanes, length), dtype=np.int64)
+        for lane, data in enumerate(inputs):
+            self.input[lane, :len(data)] = np.frombuffer(bytes(data), dtype=np.uint8)
+        self.input_length = np.array([len(data) for data in inputs], dtype=np.int64)
+        self.input_position = np.zeros(lanes, dtype=np.int64)
+
+        self.halted = np.zeros(lanes, dtype=bool)
+        self.failed = np.zeros(lanes, dtype=bool)
+        self.errors = [None for lane in range(0, lanes)]
+        self.cycles = 0
+        # (lanes, values, kind) for every output instruction, in the order they ran
+        self.log = []
+
+        self.handlers = {
+            0b00000: self.NOP, 0b00001: self.LDA, 0b00010: self.LDB, 0b00011: self.FREE,
+            0b00100: self.READ, 0b00101: self.ADD, 0b00110: self.HLT, 0b00111: self.PRX,
+            0b01000: self.JMP, 0b01001: self.STA, 0b01010: self.STB, 0b01011: self.INC,
+            0b01100: self.DEC, 0b01101: self.MOV, 0b01110: self.CMP, 0b01111: self.JE,
+            0b10000: self.NEG, 0b10001: self.CALL, 0b10010: self.RET, 0b10011: self.PUSH,
+            0b10100: self.POP, 0b10101: self.SAVE, 0b10110: self.JNE, 0b10111: self.JG,
+            0b11000: self.JL, 0b11001: self.JGE, 0b11010: self.JLE, 0b11011: self.OFF,
+            0b11100: self.MUL, 0b11101: self.DIV, 0b11110: self.PRC, 0b11111: self.DUP,
+        }
+
+    def run(self, max_cycles=None):
+        """Run until every lane has halted or failed, or for at most max_cycles cycles. Returns the outputs."""
+        while max_cycles is None or self.cycles < max_cycles:
+            lanes = np.flatnonzero(~(self.halted | self.failed))
+            if not lanes.size:
+                break
+            address = self.registers[lanes, IR]
+            lanes, instruction_bytes = self.read(lanes, address)
+            lanes, data = self.read(lanes, (self.registers[lanes, IR] + 1) % 256)
+            self.registers[lanes, IR] = (self.registers[lanes, IR] + 2) % 256
+            self.cycles += 1
+            keys = instruction_bytes * 256 + data
+            first = keys[0] if keys.size else None
+            if keys.size and (keys == first).all():
+                self.execute(lanes, int(first))
+            else:
+                groups, inverse = np.unique(keys, return_inverse=True)
+                for group, key in enumerate(groups):
+                    self.execute(lanes[inverse == group], int(key))
+        return self.outputs
+
+    def execute(self, lanes, key):
+        instruction_byte, data = key >> 8, key & 0b1111_1111
+        mem_flag = instruction_byte >> 7
+        stack_flag = (instruction_byte >> 6) & 1
+        if is_bank_select(instruction_byte):
+            self.BANK(lanes, mem_flag, stack_flag, data)
+            return
+        self.handlers[instruction_byte & 0b0001_1111](lanes, mem_flag, stack_flag, data)
+
+    @property
+    def outputs(self):
+        """Output of every lane, numbers as ints and characters as strings like OctoEngine.output."""
+        outputs = [[] for lane in range(0, self.lanes)]
+        if not self.log:
+            return outputs
+        lanes = np.concatenate([lanes for lanes, values, kind in self.log])
+        values = np.concatenate([values for lanes, values, kind in self.log])
+        kinds = np.concatenate([np.full(len(lanes), kind) for lanes, values, kind in self.log])
+        order = np.argsort(lanes, kind="stable")
+        for lane, value, kind in zip(lanes[order].tolist(), values[order].tolist(), kinds[order].tolist()):
+            outputs[lane].append(chr(value) if kind == CHAR else value)
+        return outputs
+
+    # Lanes that raise are taken out of the group, these return the lanes that carry on
+
+    def fail(self, lanes, exception):
+        self.failed[lanes] = True
+        for lane in lanes.tolist():
+            self.errors[lane] = exception
+
+    def check(self, lanes, bad, exception, *values):
+        if not bad.any():
+            return (lanes, *values)
+        self.fail(lanes[bad], exception)
+        keep = ~bad
+        return (lanes[keep], *[value[keep] for value in values])
+
+    def read(self, lanes, addresses):
+        lanes, addresses = self.check(lanes, addresses > 255, MemoryAccessException("Out of bounds memory access"), addresses)
+        values = self.memory[lanes, addresses].astype(np.int64)
+        registers = addresses >= REGISTER_START
+        if registers.any():
+            values[registers] = self.registers[lanes[registers], 255 - addresses[registers]]
+        return lanes, values
+
+    def write(self, lanes, addresses, values):
+        lanes, addresses, values = self.check(lanes, addresses > 255, MemoryAccessException("Out of bounds memory access"), addresses, values)
+        lanes, addresses, values = self.check(lanes, (values < 0) | (values > 255), MemoryAccessException("Tried to store an out of bounds value in memory"), addresses, values)
+        self.memory[lanes, addresses] = values
+        return lanes
+
+    def stack_address(self, lanes, depth):
+        """Address in the stack entry depth from the top plus the offset register, as the stack addressing mode uses."""
+        lanes, entries = self.stack_entry(lanes, depth)
+        return lanes, entries + self.registers[lanes, OFFSET]
+
+    def stack_entry(self, lanes, depth):
+        """The entry depth places down each lane's stack, 1 being the top, as components.stack.stack_entry."""
+        sp = self.sp[lanes]
+        lanes, sp = self.check(lanes, (depth <= 0) | (depth > sp), underflow("Stack"), sp)
+        return lanes, self.stack[lanes, sp - depth]
+
+    def push(self, lanes, values):
+        lanes, values = self.check(lanes, self.sp[lanes] >= self.stack.shape[1], overflow("Stack", self.stack.shape[1]), values)
+        self.stack[lanes, self.sp[lanes]] = values
+        self.sp[lanes] += 1
+        return lanes
+
+    def record(self, lanes, values, kind):
+        if lanes.size:
+            self.log.append((lanes.copy(), np.broadcast_to(values, lanes.shape).copy(), kind))
+
+    # Instructions, in the same order and with the same quirks as components.instructions
+
+    def NOP(self, lanes, mem_flag, stack_flag, data):
+        pass
+
+    def load(self, lanes, column, name, mem_flag, stack_flag, data):
+        if mem_flag and stack_flag:
+            lanes, values = self.stack_address(lanes, data)
+            lanes, values = self.check(lanes, values > 255, RegisterException(f"Loaded value < 0 or > 255 into register {name}"), values)
+        elif mem_flag:
+            lanes, values = self.read(lanes, data + self.registers[lanes, OFFSET])
+        elif stack_flag:
+            lanes, addresses = self.stack_address(lanes, data)
+            lanes, values = self.read(lanes, addresses)
+        else:
+            values = data
+        self.registers[lanes, column] = values
+
+    def LDA(self, lanes, mem_flag, stack_flag, data):
+        self.load(lanes, A, "A", mem_flag, stack_flag, data)
+
+    def LDB(self, lanes, mem_flag, stack_flag, data):
+        self.load(lanes, B, "B", mem_flag, stack_flag, data)
+
+    def FREE(self, lanes, mem_flag, stack_flag, data):
+        if mem_flag:
+            lanes = self.check(lanes, self.sp[lanes] == 0, underflow("Stack"))[0]
+            starts = self.stack[lanes, self.sp[lanes] - 1]
+            lanes, lengths = self.read(lanes, starts)
+            ends = starts + lengths + 1
+            columns = np.arange(0, 256)
+            freed = (columns >= starts[:, None]) & (columns < ends[:, None])
+            self.occupied[lanes] &= ~freed
+            memory = self.memory[lanes]
+            memory[freed] = 222 # Mark as freed for debugging purposes
+            self.memory[lanes] = memory
+            # Freeing past the end of memory writes up to it and then fails
+            lanes = self.check(lanes, ends > 256, MemoryAccessException("Out of bounds memory access"))[0]
+            self.sp[lanes] -= 1
+            self.drop_saved(lanes)
+            return
+        lanes = self.check(lanes, self.sp[lanes] < data, underflow("Stack"))[0]
+        for i in range(0, data):
+            addresses = self.stack[lanes, self.sp[lanes] - data + i]
+            self.occupied[lanes, addresses] = False
+            self.memory[lanes, addresses] = 255
+        self.sp[lanes] -= data
+        self.drop_saved(lanes)
+
+    def BANK(self, lanes, mem_flag, stack_flag, data):
+        # Lanes have a single bank, as an OctoEngine started with banks=1
+        if mem_flag:
+            lanes, banks = self.read(lanes, np.full(lanes.shape, data))
+        elif stack_flag:
+            lanes, addresses = self.stack_address(lanes, data)
+            lanes, banks = self.read(lanes, addresses)
+        else:
+            banks = np.full(lanes.shape, data)
+        self.check(lanes, banks != 0, MemoryAccessException("No memory bank (1 banks)"))
+
+    def READ(self, lanes, mem_flag, stack_flag, data):
+        empty = self.input_position[lanes] >= self.input_length[lanes]
+        if empty.any():
+            # Left to run again, as OctoEngine does when it runs out of input
+            self.registers[lanes[empty], IR] = (self.registers[lanes[empty], IR] - 2) % 256
+        lanes = self.check(lanes, empty, InputException("End of input"))[0]
+        self.registers[lanes, FUNC] = self.input[lanes, self.input_position[lanes]]
+        self.input_position[lanes] += 1
+
+    def ADD(self, lanes, mem_flag, stack_flag, data):
+        self.registers[lanes, A] = (self.registers[lanes, A] + self.registers[lanes, B]) % 256
+
+    def HLT(self, lanes, mem_flag, stack_flag, data):
+        self.halted[lanes] = True
+
+    def PRX(self, lanes, mem_flag, stack_flag, data):
+        if mem_flag:
+            lanes, values = self.read(lanes, np.full(lanes.shape, data))
+        elif stack_flag:
+            lanes, addresses = self.stack_address(lanes, data)
+            lanes, values = self.read(lanes, addresses)
+        else:
+            values = data
+        self.record(lanes, values, NUMBER)
+
+    def JMP(self, lanes, mem_flag, stack_flag, data):
+        if mem_flag:
+            lanes, values = self.read(lanes, np.full(lanes.shape, data))
+        else:
+            values = data
+        self.registers[lanes, IR] = values
+
+    def store(self, lanes, column, stack_flag, data):
+        if stack_flag:
+            lanes, addresses = self.stack_address(lanes, data)
+        else:
+            addresses = np.full(lanes.shape, data)
+        self.write(lanes, addresses, self.registers[lanes, column])
+
+    def STA(self, lanes, mem_flag, stack_flag, data):
+        self.store(lanes, A, stack_flag, data)
+
+    def STB(self, lanes, mem_flag, stack_flag, data):
+        self.store(lanes, B, stack_flag, data)
+
+    def step(self, lanes, stack_flag, data, amount):
+        if stack_flag:
+            lanes, addresses = self.stack_address(lanes, data)
+        else:
+            addresses = np.full(lanes.shape, data)
+        registers = (addresses >= REGISTER_START) & (addresses <= 255)
+        if registers.any():
+            columns = 255 - addresses[registers]
+            self.registers[lanes[registers], columns] = (self.registers[lanes[registers], columns] + amount) % 256
+        lanes, addresses = lanes[~registers], addresses[~registers]
+        lanes, addresses = self.check(lanes, addresses > 255, MemoryAccessException("Out of bounds memory access"), addresses)
+        self.write(lanes, addresses, self.memory[lanes, addresses].astype(np.int64) + amount)
+
+    def INC(self, lanes, mem_flag, stack_flag, data):
+        self.step(lanes, stack_flag, data, 1)
+
+    def DEC(self, lanes, mem_flag, stack_flag, data):
+        self.step(lanes, stack_flag, data, -1)
+
+    def MOV(self, lanes, mem_flag, stack_flag, data):
+        into = (data & 0b11110000) >> 4
+        from_ = data & 0b1111
+        if into > 5 or from_ > 5:
+            self.fail(lanes, KeyError(255 - (into if into > 5 else from_)))
+            return
+        self.registers[lanes, into] = self.registers[lanes, from_]
+
+    def CMP(self, lanes, mem_flag, stack_flag, data):
+        self.comparison[lanes] = self.registers[lanes, A] - self.registers[lanes, B]
+
+    def jump(self, lanes, taken, data):
+        self.registers[lanes[taken], IR] = data
+
+    def JE(self, lanes, mem_flag, stack_flag, data):
+        self.jump(lanes, self.comparison[lanes] == 0, data)
+
+    def JNE(self, lanes, mem_flag, stack_flag, data):
+        self.jump(lanes, self.comparison[lanes] != 0, data)
+
+    def JG(self, lanes, mem_flag, stack_flag, data):
+        self.jump(lanes, self.comparison[lanes] > 0, data)
+
+    def JL(self, lanes, mem_flag, stack_flag, data):
+        self.jump(lanes, self.comparison[lanes] < 0, data)
+
+    def JGE(self, lanes, mem_flag, stack_flag, data):
+        self.jump(lanes, self.comparison[lanes] >= 0, data)
+
+    def JLE(self, lanes, mem_flag, stack_flag, data):
+        self.jump(lanes, self.comparison[lanes] <= 0, data)
+
+    def NEG(self, lanes, mem_flag, stack_flag, data):
+        # B is left negated, as the subtraction is done by adding -B
+        self.registers[lanes, B] = -self.registers[lanes, B] & 0b11111111
+        self.registers[lanes, A] = (self.registers[lanes, A] + self.registers[lanes, B]) % 256
+
+    def CALL(self, lanes, mem_flag, stack_flag, data):
+        if stack_flag:
+            lanes, addresses = self.stack_address(lanes, data)
+            lanes, targets = self.read(lanes, addresses)
+        else:
+            targets = np.full(lanes.shape, data)
+        size = self.call_stack.shape[1]
+        lanes, targets = self.check(lanes, self.call_sp[lanes] >= size, overflow("Call stack", size), targets)
+        self.call_stack[lanes, self.call_sp[lanes]] = self.registers[lanes, IR]
+        self.call_sp[lanes] += 1
+        self.registers[lanes, IR] = targets
+
+    def RET(self, lanes, mem_flag, stack_flag, data):
+        if not stack_flag:
+            self.registers[lanes, FUNC] = data
+        lanes = self.check(lanes, self.call_sp[lanes] == 0, underflow("Call stack"))[0]
+        lanes = self.check(lanes, self.sp[lanes] < 2, underflow("Stack"))[0]
+        self.call_sp[lanes] -= 1
+        self.registers[lanes, IR] = self.call_stack[lanes, self.call_sp[lanes]]
+        self.sp[lanes] -= 2
+        self.registers[lanes, A] = self.stack[lanes, self.sp[lanes]]
+        self.registers[lanes, B] = self.stack[lanes, self.sp[lanes] + 1]
+        self.drop_saved(lanes)
+
+    def drop_saved(self, lanes):
+        # SAVE pairs popped off the stack stop being skipped by heap compaction, as in OctoEngine
+        live = (self.saved[lanes] < self.sp[lanes, None]) & (np.arange(self.saved.shape[1]) < self.saved_count[lanes, None])
+        self.saved_count[lanes] = live.sum(axis=1)
+
+    def PUSH(self, lanes, mem_flag, stack_flag, data):
+        length = max(data, 1)
+        found, addresses = self.first_fit(lanes, length)
+        if not found.all():
+            # Fragmented, slide everything down and try once more
+            for lane in lanes[~found].tolist():
+                self.compact(lane)
+            retry = ~found
+            found[retry], addresses[retry] = self.first_fit(lanes[retry], length)
+        lanes, addresses = self.check(lanes, ~found, OutOfMemoryException("Out of memory"), addresses)
+        columns = np.arange(0, 256)
+        self.occupied[lanes] |= (columns >= addresses[:, None]) & (columns < addresses[:, None] + length)
+        self.push(lanes, addresses)
+
+    def POP(self, lanes, mem_flag, stack_flag, data):
+        lanes = self.check(lanes, self.sp[lanes] < data, underflow("Stack"))[0]
+        self.sp[lanes] -= data
+        self.drop_saved(lanes)
+
+    def SAVE(self, lanes, mem_flag, stack_flag, data):
+        size = self.stack.shape[1]
+        lanes = self.check(lanes, self.sp[lanes] + 2 > size, overflow("Stack", size))[0]
+        self.saved[lanes, self.saved_count[lanes]] = self.sp[lanes]
+        self.saved_count[lanes] += 1
+        self.stack[lanes, self.sp[lanes]] = self.registers[lanes, A]
+        self.stack[lanes, self.sp[lanes] + 1] = self.registers[lanes, B]
+        self.sp[lanes] += 2
+
+    def OFF(self, lanes, mem_flag, stack_flag, data):
+        if mem_flag:
+            lanes, values = self.read(lanes, np.full(lanes.shape, data))
+        elif stack_flag:
+            lanes, addresses = self.stack_address(lanes, data)
+            lanes, values = self.read(lanes, addresses)
+        else:
+            values = data
+        self.registers[lanes, OFFSET] = values
+
+    def MUL(self, lanes, mem_flag, stack_flag, data):
+        self.registers[lanes, A] = (self.registers[lanes, A] * self.registers[lanes, B]) % 256
+
+    def DIV(self, lanes, mem_flag, stack_flag, data):
+        lanes = self.check(lanes, self.registers[lanes, B] == 0, ZeroDivisionError("integer division or modulo by zero"))[0]
+        self.registers[lanes, A] = self.registers[lanes, A] // self.registers[lanes, B]
+
+    def PRC(self, lanes, mem_flag, stack_flag, data):
+        if stack_flag:
+            lanes, addresses = self.stack_address(lanes, data)
+            lanes, values = self.read(lanes, addresses)
+        elif data == 10:
+            # Literal newlines are not recorded, see components.output.ListSink
+            return
+        else:
+            values = np.full(lanes.shape, data)
+        lanes, values = self.check(lanes, values > 127, UnicodeDecodeError("utf-8", b"\x80", 0, 1, "invalid start byte"), values)
+        self.record(lanes, values, CHAR)
+
+    def DUP(self, lanes, mem_flag, stack_flag, data):
+        lanes, values = self.stack_entry(lanes, data)
+        self.push(lanes, values)
+
+    # Heap
+
+    def first_fit(self, lanes, length):
+        """Whether each lane has a free run of length bytes in its heap, and where the first one starts."""
+        free = ~self.occupied[lanes]
+        free[:, :self.program_end] = False
+        free[:, HEAP_END:] = False
+        totals = np.zeros((len(lanes), 257), dtype=np.int64)
+        np.cumsum(free, axis=1, out=totals[:, 1:])
+        runs = (totals[:, length:] - totals[:, :-length]) == length
+        return runs.any(axis=1), runs.argmax(axis=1)
+
+    def compact(self, lane):
+        """OctoEngine.compact_heap() for one lane."""
+        occupied = self.occupied[lane]
+        memory = self.memory[lane]
+        relocated = np.arange(0, 256)
+        destination = address = self.program_end
+        while address < HEAP_END:
+            if not occupied[address]:
+                address += 1
+                continue
+            length = 1
+            while address + length < HEAP_END and occupied[address + length]:
+                length += 1
+            if address != destination:
+                memory[destination:destination+length] = memory[address:address+length].copy()
+                relocated[address:address+length] = np.arange(destination, destination+length)
+                self.bytes_moved[lane] += length
+            destination += length
+            address += length
+        occupied[:] = False
+        occupied[self.program_end:destination] = True
+        self.compactions[lane] += 1
+
+        saved = set()
+        for depth in self.saved[lane, :self.saved_count[lane]].tolist():
+            saved.update((depth, depth+1))
+        for i in range(0, self.sp[lane]):
+            if i not in saved:
+                self.stack[lane, i] = relocated[self.stack[lane, i]]
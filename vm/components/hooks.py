@@ -0,0 +1,121 @@
+from components.stack import stack_entry
+
+class Tracer:
+    """
+    Observer for a single OctoEngine, registered with OctoEngine.add_tracer().
+    Override the events you are interested in, the rest are no-ops.
+    """
+    def on_instruction(self, emulator, address, instruction, data):
+        # Called before the instruction byte at address is executed
+        pass
+
+    def on_memory_write(self, emulator, address, value):
+        # Every byte written to memory, by stores and by FREE and heap compaction
+        pass
+
+    def on_push(self, emulator, address, length):
+        pass
+
+    def on_free(self, emulator, address, length):
+        pass
+
+    def on_compact(self, emulator, moves):
+        # Heap compaction moved length bytes from address to destination for each (address, destination, length)
+        pass
+
+    def on_call(self, emulator, return_address, target):
+        pass
+
+    def on_ret(self, emulator, return_address):
+        pass
+
+
+class DebugTracer(Tracer):
+    """Prints the registers, stack and start of the heap before every instruction."""
+    def __init__(self, step=False):
+        self.step = step
+
+    def on_instruction(self, emulator, address, instruction, data):
+        print(f"Registers: A:{emulator.reg_a}, B:{emulator.reg_b}, F:{emulator.reg_func}, O:{emulator.reg_offset}, I:{address}")
+        print(f"Stack: {list(emulator.stack[:emulator.sp])}")
+        start = emulator.heap.start
+        length = 256-16-start
+        length = min(20, length)
+        print(f"Mem: {list(emulator.memory.memory[start:start+length])}")
+        if self.step:
+            input()
+        else:
+            print()
+
+
+def stored_address(emulator, stack_flag, data):
+    if stack_flag:
+        return stack_entry(emulator, data)+emulator.reg_offset
+    return data
+
+def trace_store(handler):
+    def wrapper(emulator, mem_flag, stack_flag, data):
+        address = stored_address(emulator, stack_flag, data)
+        handler(emulator, mem_flag, stack_flag, data)
+        value = emulator.memory.read(address)
+        for tracer in emulator.tracers:
+            tracer.on_memory_write(emulator, address, value)
+    return wrapper
+
+def trace_push(handler):
+    def wrapper(emulator, mem_flag, stack_flag, data):
+        handler(emulator, mem_flag, stack_flag, data)
+        for tracer in emulator.tracers:
+            tracer.on_push(emulator, emulator.stack[emulator.sp-1], data)
+    return wrapper
+
+def trace_free(handler):
+    def wrapper(emulator, mem_flag, stack_flag, data):
+        if mem_flag:
+            top = emulator.stack[emulator.sp-1]
+            freed = [(top, emulator.memory.read(top) + 1)]
+        else:
+            freed = [(emulator.stack[emulator.sp-(i+1)], 1) for i in range(0, data)]
+        handler(emulator, mem_flag, stack_flag, data)
+        for tracer in emulator.tracers:
+            for address, length in freed:
+                # FREE fills the freed bytes in
+                for filled in range(address, address + length):
+                    tracer.on_memory_write(emulator, filled, emulator.memory.read(filled))
+                tracer.on_free(emulator, address, length)
+    return wrapper
+
+def trace_call(handler):
+    def wrapper(emulator, mem_flag, stack_flag, data):
+        handler(emulator, mem_flag, stack_flag, data)
+        for tracer in emulator.tracers:
+            tracer.on_call(emulator, emulator.call_stack[emulator.call_sp-1], emulator.instruction_register)
+    return wrapper
+
+def trace_ret(handler):
+    def wrapper(emulator, mem_flag, stack_flag, data):
+        handler(emulator, mem_flag, stack_flag, data)
+        for tracer in emulator.tracers:
+            tracer.on_ret(emulator, emulator.instruction_register)
+    return wrapper
+
+trace_events = {
+    0b00011: trace_free,
+    0b01001: trace_store,
+    0b01010: trace_store,
+    0b01011: trace_store,
+    0b01100: trace_store,
+    0b10001: trace_call,
+    0b10010: trace_ret,
+    0b10011: trace_push,
+}
+
+def build_traced_dispatch_table(table):
+    """Wrap the handlers of a dispatch table so they report to emulator.tracers."""
+    traced = []
+    for instruction_byte, handler in enumerate(table):
+        instruction = instruction_byte & 0b0001_1111
+        if handler is not None and instruction in trace_events:
+            handler = trace_events[instruction](handler)
+        traced.append(handler)
+    return traced
@@ -0,0 +1,70 @@
+import threading
+
+from components.memory import MemoryAccessException, HEAP_END
+from components.instructions import InstructionException
+
+def decode_instruction(dispatch, instruction_byte, data, address):
+    """(handler, mem_flag, stack_flag, data) entry for the instruction at address."""
+    handler = dispatch[instruction_byte]
+    if handler is None:
+        raise InstructionException(f"Undefined instruction: {instruction_byte & 0b0001_1111} at memory address {address}")
+    mem_flag = (instruction_byte & 0b1000_0000) >> 7
+    stack_flag = (instruction_byte & 0b0100_0000) >> 6
+    return (handler, mem_flag, stack_flag, data)
+
+
+class ProgramImage:
+    """
+    A compiled program, checked and decoded once and shared by any number of
+    engines. OctoEngine.load() copies the bytes into the engine's own memory
+    and takes its decoded instructions from here, so loading the same image
+    into many engines does no per instance decoding.
+
+    A program compiled for Harvard mode also has data, loaded at the start of
+    the data space of an OctoEngine(harvard=True) with the code in its own space.
+    """
+    __slots__ = ("code", "data", "program_end", "data_end", "tables", "lock", "verified")
+
+    def __init__(self, code, data=b""):
+        if len(code) > 256:
+            raise MemoryAccessException(f"Out of bounds memory access (program is {len(code)} bytes)")
+        if len(data) > HEAP_END:
+            raise MemoryAccessException(f"Out of bounds memory access (data is {len(data)} bytes)")
+        try:
+            self.code = bytes(code)
+            self.data = bytes(data)
+        except (TypeError, ValueError):
+            raise MemoryAccessException(f"Tried to load a program containing non byte values")
+        self.program_end = len(self.code)
+        self.data_end = len(self.data)
+        # (dispatch table, unchecked handlers, decoded instructions) for each way engines have loaded this image
+        self.tables = []
+        # Engines on other threads may load this image at the same time
+        self.lock = threading.Lock()
+        # (reachable addresses, unchecked handlers) by (banks, stack size, harvard) from components.verifier
+        self.verified = {}
+
+    def decoded(self, dispatch, unchecked=None):
+        """
+        Decoded instructions for every address in the program, None elsewhere.
+        unchecked maps addresses to (checked, unchecked) handlers, as
+        components.verifier.unchecked_handlers gives for a verified image.
+        """
+        with self.lock:
+            for table, table_unchecked, decoded in self.tables:
+                if table is dispatch and table_unchecked is unchecked:
+                    return decoded
+            code = self.code
+            decoded = [
+                decode_instruction(dispatch, code[address], code[address+1], address) if address % 2 == 0 and address + 1 < self.program_end else None
+                for address in range(0, 256)
+            ]
+            if unchecked:
+                for address, (checked, handler) in unchecked.items():
+                    entry = decoded[address]
+                    # Traced and debug tables wrap the handlers, those keep the checked path
+                    if entry[0] is checked:
+                        decoded[address] = (handler,) + entry[1:]
+            decoded = tuple(decoded)
+            self.tables.append((dispatch, unchecked, decoded))
+            return decoded
@@ -0,0 +1,67 @@
+import os
+import collections
+
+class InputException(Exception):
+    pass
+
+class InputSource:
+    """
+    Bytes for READ. Input pushed with feed() comes first, then the source
+    (a file object or a file descriptor such as a pipe) is read in chunks of
+    up to chunk_size bytes. Each READ takes the next byte of the current
+    chunk, so nothing is copied per byte. before_read is called before each
+    read from the source, which may block.
+    """
+    __slots__ = ("chunks", "chunk", "position", "source", "chunk_size", "before_read")
+
+    def __init__(self, source=None, chunk_size=65536, before_read=None):
+        self.chunks = collections.deque()
+        self.chunk = b""
+        self.position = 0
+        self.source = None
+        self.chunk_size = chunk_size
+        self.before_read = before_read
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            self.feed(source)
+        else:
+            self.source = source
+
+    def feed(self, data):
+        if data:
+            self.chunks.append(bytes(data))
+
+    def buffered(self):
+        """Input that has been fed or read from the source but not yet taken by READ."""
+        return bytes(self.chunk[self.position:]) + b"".join(self.chunks)
+
+    def clear(self):
+        self.chunks.clear()
+        self.chunk = b""
+        self.position = 0
+
+    def read_byte(self):
+        if self.position == len(self.chunk) and not self.refill():
+            raise InputException("End of input")
+        byte = self.chunk[self.position]
+        self.position += 1
+        return byte
+
+    def refill(self):
+        if not self.chunks and self.source is not None:
+            if self.before_read is not None:
+                self.before_read()
+            self.feed(self.read_source())
+        if not self.chunks:
+            return False
+        self.chunk = self.chunks.popleft()
+        self.position = 0
+        return True
+
+    def read_source(self):
+        if isinstance(self.source, int):
+            return os.read(self.source, self.chunk_size)
+        # Text streams like sys.stdin are read through their binary buffer
+        source = getattr(self.source, "buffer", self.source)
+        # read1 returns whatever is available (a line from a terminal) rather than waiting for a full chunk
+        read = getattr(source, "read1", source.read)
+        return read(self.chunk_size)
@@ -1,285 +1,301 @@
-import sys
-import codecs
+from components.register import REGISTERS, check_register
+from components.allocator import OutOfMemoryException
+from components.stack import overflow, underflow, stack_entry
+from components.input import InputException
+from components.limits import LimitException
 
-from settings import debug as INSTRUCTION_DEBUG
-
-def debug(function):
-    def wrapper(*args, **kwargs):
-        if INSTRUCTION_DEBUG:
-            print(f"Instruction {function.__name__}")
-        function(*args, **kwargs)
+def debug(name, function):
+    def wrapper(emulator, mem_flag, stack_flag, data):
+        print(f"Instruction {name}")
+        function(emulator, mem_flag, stack_flag, data)
     return wrapper
 
-def debug_addr(function):
-    def wrapper(*args, **kwargs):
-        if INSTRUCTION_DEBUG:
-            print(f"Instruction {function.__name__} mem_flag={args[1]}, stack_flag={args[2]}, data={args[3]}")
-        function(*args, **kwargs)
+def debug_addr(name, function):
+    def wrapper(emulator, mem_flag, stack_flag, data):
+        print(f"Instruction {name} mem_flag={mem_flag}, stack_flag={stack_flag}, data={data}")
+        function(emulator, mem_flag, stack_flag, data)
     return wrapper
 
-def debug_addr_data(function):
-    def wrapper(*args, **kwargs):
-        if INSTRUCTION_DEBUG:
-            print(f"Instruction {function.__name__} mem_flag={args[1]}, stack_flag={args[2]}, data={args[3]}")
-            #print(f"Instruction m={args[1]}, {function.__name__}, [{args[2]}] -> ({args[0].memory[args[2]]})")
-        function(*args, **kwargs)
+def debug_addr_store(name, function):
+    def wrapper(emulator, mem_flag, stack_flag, data):
+        function(emulator, mem_flag, stack_flag, data)
+        print(f"Instruction {name} mem_flag={mem_flag}, stack_flag={stack_flag}, data={data}")
     return wrapper
 
-def debug_addr_data_store(function):
-    def wrapper(*args, **kwargs):
-        function(*args, **kwargs)
-        if INSTRUCTION_DEBUG:
-            print(f"Instruction {function.__name__} mem_flag={args[1]}, stack_flag={args[2]}, data={args[3]}")
-            #print(f"Instruction m={args[1]}, {function.__name__}, [{args[2]}] <- ({args[0].memory[args[2]]})")
-    return wrapper
-        
 
-@debug
 def NOP(emulator, mem_flag, stack_flag, data):
     pass
 
-@debug_addr_data
 def LDA(emulator, mem_flag, stack_flag, data):
-    if mem_flag and stack_flag:
-        emulator.reg_a.load(emulator.stack[-data]+emulator.reg_offset.value)
-    elif mem_flag:
-        emulator.reg_a.load(emulator.memory[data+emulator.reg_offset.value])
-    elif stack_flag:
-        emulator.reg_a.load(emulator.memory[emulator.stack[-data]+emulator.reg_offset.value])
-    else:
-        emulator.reg_a.load(data)
+    emulator.reg_a = data
+
+def LDA_mem(emulator, mem_flag, stack_flag, data):
+    emulator.reg_a = emulator.memory.read(data+emulator.reg_offset)
+
+def LDA_stack(emulator, mem_flag, stack_flag, data):
+    emulator.reg_a = emulator.memory.read(stack_entry(emulator, data)+emulator.reg_offset)
+
+def LDA_stack_mem(emulator, mem_flag, stack_flag, data):
+    emulator.reg_a = check_register("A", stack_entry(emulator, data)+emulator.reg_offset)
 
-@debug_addr_data
 def LDB(emulator, mem_flag, stack_flag, data):
-    if mem_flag and stack_flag:
-        emulator.reg_b.load(emulator.stack[-data]+emulator.reg_offset.value)
-    elif mem_flag:
-        emulator.reg_b.load(emulator.memory[data+emulator.reg_offset.value])
-    elif stack_flag:
-        emulator.reg_b.load(emulator.memory[emulator.stack[-data]+emulator.reg_offset.value])
-    else:
-        emulator.reg_b.load(data)
+    emulator.reg_b = data
+
+def LDB_mem(emulator, mem_flag, stack_flag, data):
+    emulator.reg_b = emulator.memory.read(data+emulator.reg_offset)
+
+def LDB_stack(emulator, mem_flag, stack_flag, data):
+    emulator.reg_b = emulator.memory.read(stack_entry(emulator, data)+emulator.reg_offset)
+
+def LDB_stack_mem(emulator, mem_flag, stack_flag, data):
+    emulator.reg_b = check_register("B", stack_entry(emulator, data)+emulator.reg_offset)
 
-@debug
 def PRA(emulator, mem_flag, stack_flag, data):
     print(emulator.reg_a)
 
-@debug
 def PRB(emulator, mem_flag, stack_flag, data):
     print(emulator.reg_b)
 
-@debug
 def ADD(emulator, mem_flag, stack_flag, data):
-    emulator.reg_a += emulator.reg_b
+    emulator.reg_a = (emulator.reg_a + emulator.reg_b) % 256
 
-@debug
 def HLT(emulator, mem_flag, stack_flag, data):
     emulator.halt()
 
-@debug_addr_data
 def PRX(emulator, mem_flag, stack_flag, data):
-    to_print = 0
-    if mem_flag:
-        to_print = emulator.memory[data]
-    elif stack_flag:
-        to_print = emulator.memory[emulator.stack[-data]+emulator.reg_offset.value]
-    else:
-        to_print = data
-    #print(str(bytes([to_print,]), "utf8"))
-    if not emulator.redirect_output:
-        print(to_print, end="")
-    emulator.output.append(to_print)
+    for sink in emulator.sinks:
+        sink.write_number(data)
+
+def PRX_mem(emulator, mem_flag, stack_flag, data):
+    PRX(emulator, mem_flag, stack_flag, emulator.memory.read(data))
+
+def PRX_stack(emulator, mem_flag, stack_flag, data):
+    PRX(emulator, mem_flag, stack_flag, emulator.memory.read(stack_entry(emulator, data)+emulator.reg_offset))
 
-@debug_addr
 def JMP(emulator, mem_flag, stack_flag, data):
-    if mem_flag:
-        emulator.instruction_register.load(emulator.memory[data])
-    else:
-        emulator.instruction_register.load(data)
+    emulator.instruction_register = data
+
+def JMP_mem(emulator, mem_flag, stack_flag, data):
+    emulator.instruction_register = emulator.memory.read(data)
 
-@debug_addr_data_store
 def STA(emulator, mem_flag, stack_flag, data):
-    if stack_flag:
-        emulator.memory[emulator.stack[-data]+emulator.reg_offset.value] = emulator.reg_a.value
-    else:
-        emulator.memory[data] = emulator.reg_a.value
+    emulator.memory.write(data, emulator.reg_a)
+
+def STA_stack(emulator, mem_flag, stack_flag, data):
+    emulator.memory.write(stack_entry(emulator, data)+emulator.reg_offset, emulator.reg_a)
 
-@debug_addr_data_store
 def STB(emulator, mem_flag, stack_flag, data):
-    if stack_flag:
-        emulator.memory[emulator.stack[-data]+emulator.reg_offset.value] = emulator.reg_b.value
-    else:
-        emulator.memory[data] = emulator.reg_b.value
+    emulator.memory.write(data, emulator.reg_b)
+
+def STB_stack(emulator, mem_flag, stack_flag, data):
+    emulator.memory.write(stack_entry(emulator, data)+emulator.reg_offset, emulator.reg_b)
+
+def STA_unchecked(emulator, mem_flag, stack_flag, data):
+    # Verified to be outside the program and below the reserved bytes
+    emulator.memory.memory[data] = emulator.reg_a
+
+def STB_unchecked(emulator, mem_flag, stack_flag, data):
+    emulator.memory.memory[data] = emulator.reg_b
 
-@debug_addr
 def INC(emulator, mem_flag, stack_flag, data):
-    if stack_flag:
-        emulator.memory[emulator.stack[-data]+emulator.reg_offset.value] += 1
-    else:
-        emulator.memory[data] += 1
+    emulator.memory.add(data, 1)
+
+def INC_stack(emulator, mem_flag, stack_flag, data):
+    emulator.memory.add(stack_entry(emulator, data)+emulator.reg_offset, 1)
     
-@debug_addr
 def DEC(emulator, mem_flag, stack_flag, data):
-    if stack_flag:
-        emulator.memory[emulator.stack[-data]+emulator.reg_offset.value] -= 1
-    else:
-        emulator.memory[data] -= 1
+    emulator.memory.add(data, -1)
+
+def DEC_stack(emulator, mem_flag, stack_flag, data):
+    emulator.memory.add(stack_entry(emulator, data)+emulator.reg_offset, -1)
     
-@debug_addr
+def INC_register(emulator, mem_flag, stack_flag, data):
+    # Verified to be a register address
+    register = REGISTERS[data]
+    setattr(emulator, register, (getattr(emulator, register) + 1) % 256)
+
+def DEC_register(emulator, mem_flag, stack_flag, data):
+    register = REGISTERS[data]
+    setattr(emulator, register, (getattr(emulator, register) - 1) % 256)
+
 def MOV(emulator, mem_flag, stack_flag, data):
-    reg_1 = emulator.memory[255-((data & 0b11110000) >> 4)]
-    reg_2 = emulator.memory[255-(data & 0b1111)]
-    reg_1.load(reg_2.value)
+    into = REGISTERS[255-((data & 0b11110000) >> 4)]
+    from_ = REGISTERS[255-(data & 0b1111)]
+    setattr(emulator, into, getattr(emulator, from_))
 
-@debug
 def CMP(emulator, mem_flag, stack_flag, data):
-    reg_a = emulator.reg_a.value
-    reg_b = emulator.reg_b.value
-    emulator.comparisons["JE"] = (reg_a == reg_b)
-    emulator.comparisons["JG"] = (reg_a > reg_b)
-    emulator.comparisons["JGE"] = (reg_a >= reg_b)
-    emulator.comparisons["JL"] = (reg_a < reg_b)
-    emulator.comparisons["JLE"] = (reg_a <= reg_b)
-    emulator.comparisons["JNE"] = (reg_a != reg_b)
-
-@debug_addr
+    # Only the difference is kept, each conditional jump tests its own sign
+    emulator.comparison = emulator.reg_a - emulator.reg_b
+
 def JE(emulator, mem_flag, stack_flag, data):
-    if emulator.comparisons["JE"]:
-        emulator.instruction_register.load(data)
+    if not emulator.comparison:
+        emulator.instruction_register = data
 
-@debug
 def NEG(emulator, mem_flag, stack_flag, data):
-    emulator.reg_a -= emulator.reg_b
+    # B is left negated, as the subtraction is done by adding -B
+    emulator.reg_b = -emulator.reg_b & 0b11111111
+    emulator.reg_a = (emulator.reg_a + emulator.reg_b) % 256
 
-@debug_addr
 def CALL(emulator, mem_flag, stack_flag, data):
-    emulator.call_stack.append(emulator.instruction_register.value)
-    if stack_flag:
-        emulator.instruction_register.load(emulator.memory[emulator.stack[-data]+emulator.reg_offset.value])
-    else:
-        emulator.instruction_register.load(data)
+    call_sp = emulator.call_sp
+    if emulator.max_call_depth is not None and call_sp >= emulator.max_call_depth:
+        raise LimitException("Call depth", emulator.max_call_depth)
+    try:
+        emulator.call_stack[call_sp] = emulator.instruction_register
+    except IndexError:
+        raise overflow("Call stack", len(emulator.call_stack))
+    emulator.call_sp = call_sp = call_sp + 1
+    if call_sp > emulator.peak_call_depth:
+        emulator.peak_call_depth = call_sp
+    emulator.instruction_register = data
+
+def CALL_stack(emulator, mem_flag, stack_flag, data):
+    CALL(emulator, mem_flag, stack_flag, emulator.memory.read(stack_entry(emulator, data)+emulator.reg_offset))
 
-@debug_addr
 def RET(emulator, mem_flag, stack_flag, data):
-    emulator.instruction_register.load(emulator.call_stack.pop())
-    if not stack_flag:
-        emulator.reg_func.load(data)
-    emulator.reg_b.load(emulator.stack[-1])
-    emulator.reg_a.load(emulator.stack[-2])
-    emulator.stack = emulator.stack[:-2]
-
-@debug_addr
+    emulator.reg_func = data
+    RET_stack(emulator, mem_flag, stack_flag, data)
+
+def RET_stack(emulator, mem_flag, stack_flag, data):
+    if not emulator.call_sp:
+        raise underflow("Call stack")
+    if emulator.sp < 2:
+        raise underflow("Stack")
+    emulator.call_sp -= 1
+    emulator.instruction_register = emulator.call_stack[emulator.call_sp]
+    emulator.sp -= 2
+    emulator.reg_a = emulator.stack[emulator.sp]
+    emulator.reg_b = emulator.stack[emulator.sp+1]
+    drop_saved(emulator)
+
+def drop_saved(emulator):
+    # SAVE pairs popped off the stack stop being skipped by heap compaction
+    saved = emulator.saved
+    while saved and saved[-1] >= emulator.sp:
+        saved.pop()
+
 def PUSH(emulator, mem_flag, stack_flag, data):
-    into_addr = 0
-    for addr, occupied in emulator.memory_map.items():
-        if not occupied and all(not emulator.memory_map[a] for a in range(addr, addr+data)):
-            into_addr = addr
-            break
-    else:
-        raise Exception("Out of memory")
-    emulator.memory_map[into_addr] = True
-    for a in range(addr, addr+data):
-        emulator.memory_map[a] = True
-    emulator.stack.append(into_addr)
-    # print("Using memory address", into_addr)
-
-@debug_addr_data
+    try:
+        address = emulator.heap.allocate(data)
+    except OutOfMemoryException:
+        # Fragmented, slide everything down and try once more
+        emulator.compact_heap()
+        address = emulator.heap.allocate(data)
+    try:
+        emulator.stack[emulator.sp] = address
+    except IndexError:
+        raise overflow("Stack", len(emulator.stack))
+    emulator.sp += 1
+
 def POP(emulator, mem_flag, stack_flag, data):
-    emulator.stack = emulator.stack[:-data]
+    if emulator.sp < data:
+        raise underflow("Stack")
+    emulator.sp -= data
+    drop_saved(emulator)
 
-@debug
 def SAVE(emulator, mem_flag, stack_flag, data):
-    emulator.stack.append(emulator.reg_a.value)
-    emulator.stack.append(emulator.reg_b.value)
+    sp = emulator.sp
+    if sp + 2 > len(emulator.stack):
+        raise overflow("Stack", len(emulator.stack))
+    emulator.saved.append(sp)
+    emulator.stack[sp] = emulator.reg_a
+    emulator.stack[sp+1] = emulator.reg_b
+    emulator.sp = sp + 2
     
-@debug_addr
 def JNE(emulator, mem_flag, stack_flag, data):
-    if emulator.comparisons["JNE"]:
-        emulator.instruction_register.load(data)
+    if emulator.comparison:
+        emulator.instruction_register = data
 
-@debug_addr
 def JG(emulator, mem_flag, stack_flag, data):
-    if emulator.comparisons["JG"]:
-        emulator.instruction_register.load(data)
+    if emulator.comparison > 0:
+        emulator.instruction_register = data
         
-@debug_addr
 def JL(emulator, mem_flag, stack_flag, data):
-    if emulator.comparisons["JL"]:
-        emulator.instruction_register.load(data)
+    if emulator.comparison < 0:
+        emulator.instruction_register = data
     
-@debug_addr
 def JGE(emulator, mem_flag, stack_flag, data):
-    if emulator.comparisons["JGE"]:
-        emulator.instruction_register.load(data)
+    if emulator.comparison >= 0:
+        emulator.instruction_register = data
         
-@debug_addr
 def JLE(emulator, mem_flag, stack_flag, data):
-    if emulator.comparisons["JLE"]:
-        emulator.instruction_register.load(data)
+    if emulator.comparison <= 0:
+        emulator.instruction_register = data
 
-@debug_addr_data
 def OFF(emulator, mem_flag, stack_flag, data):
-    if mem_flag:
-        emulator.reg_offset.load(emulator.memory[data])
-    elif stack_flag:
-        emulator.reg_offset.load(emulator.memory[emulator.stack[-data]+emulator.reg_offset.value])
-    else:
-        emulator.reg_offset.load(data)
+    emulator.reg_offset = data
+
+def OFF_mem(emulator, mem_flag, stack_flag, data):
+    emulator.reg_offset = emulator.memory.read(data)
+
+def OFF_stack(emulator, mem_flag, stack_flag, data):
+    emulator.reg_offset = emulator.memory.read(stack_entry(emulator, data)+emulator.reg_offset)
         
-@debug
 def MUL(emulator, mem_flag, stack_flag, data):
-    emulator.reg_a *= emulator.reg_b
+    emulator.reg_a = (emulator.reg_a * emulator.reg_b) % 256
     
-@debug
 def DIV(emulator, mem_flag, stack_flag, data):
     emulator.reg_a //= emulator.reg_b
     
-@debug
 def PRC(emulator, mem_flag, stack_flag, data):
-    if stack_flag:
-        to_print = str(bytes([emulator.memory[emulator.stack[-data]+emulator.reg_offset.value],]), "utf8")
-        if not emulator.redirect_output:
-            print(to_print, end="")
-        emulator.output.append(to_print)
+    if data == 10:
+        for sink in emulator.sinks:
+            sink.end_line()
     else:
-        to_print = str(bytes([data,]), "utf8")
-        if not emulator.redirect_output:
-            print(to_print, end="")
-        if not to_print == "\n":
-            emulator.output.append(to_print)
+        for sink in emulator.sinks:
+            sink.write_char(data)
+
+def PRC_stack(emulator, mem_flag, stack_flag, data):
+    data = emulator.memory.read(stack_entry(emulator, data)+emulator.reg_offset)
+    for sink in emulator.sinks:
+        sink.write_char(data)
         
-@debug
 def DUP(emulator, mem_flag, stack_flag, data):
-    emulator.stack.append(emulator.stack[-data])
+    try:
+        emulator.stack[emulator.sp] = stack_entry(emulator, data)
+    except IndexError:
+        raise overflow("Stack", len(emulator.stack))
+    emulator.sp += 1
 
-@debug_addr_data
 def FREE(emulator, mem_flag, stack_flag, data):
-    if not mem_flag:
-        for i in range(0, data):
-            emulator.memory_map[emulator.stack[-(i+1)]] = False
-            emulator.memory[emulator.stack[-(i+1)]] = 255
-        emulator.stack = emulator.stack[:-data]
-    else:
-        # clear one value that is as long as the data stored in memory at [top stack]
-        memory_start = emulator.stack[-1]
-        length = emulator.memory[emulator.stack[-1]]
-        memory_end = memory_start + length + 1
-        for i in range(memory_start, memory_end):
-            emulator.memory_map[i] = False
-            emulator.memory[i] = 222 # Mark as freed for debugging purposes
-        emulator.stack = emulator.stack[:-1]
-
-@debug_addr_data
+    if emulator.sp < data:
+        raise underflow("Stack")
+    for i in range(emulator.sp-data, emulator.sp):
+        emulator.heap.free(emulator.stack[i])
+        emulator.memory.write(emulator.stack[i], 255)
+    emulator.sp -= data
+    drop_saved(emulator)
+
+def FREE_mem(emulator, mem_flag, stack_flag, data):
+    # clear one value that is as long as the data stored in memory at [top stack]
+    if not emulator.sp:
+        raise underflow("Stack")
+    memory_start = emulator.stack[emulator.sp-1]
+    length = emulator.memory.read(memory_start)
+    memory_end = memory_start + length + 1
+    emulator.heap.free(memory_start, length + 1)
+    for i in range(memory_start, memory_end):
+        emulator.memory.write(i, 222) # Mark as freed for debugging purposes
+    emulator.sp -= 1
+    drop_saved(emulator)
+
+def BANK(emulator, mem_flag, stack_flag, data):
+    emulator.memory.select_bank(data)
+
+def BANK_mem(emulator, mem_flag, stack_flag, data):
+    emulator.memory.select_bank(emulator.memory.read(data))
+
+def BANK_stack(emulator, mem_flag, stack_flag, data):
+    emulator.memory.select_bank(emulator.memory.read(stack_entry(emulator, data)+emulator.reg_offset))
+
 def READ(emulator, mem_flag, stack_flag, data):
-    if len(emulator.read_buffer) > 0:
-        char, emulator.read_buffer = emulator.read_buffer[0], emulator.read_buffer[1:]
-        emulator.reg_func.load(char)
-    else:
-        input_string = sys.stdin.readline()
-        unescaped_string = codecs.getdecoder("unicode_escape")(input_string)[0]
-        char_array = list(bytes(unescaped_string, "utf8"))
-        char, emulator.read_buffer = char_array[0], char_array[1:]
-        emulator.reg_func.load(char)
+    try:
+        emulator.reg_func = emulator.input.read_byte()
+    except InputException:
+        # Leave the READ to run again once more input has been fed, it is counted when it does
+        emulator.instruction_register = (emulator.instruction_register - 2) % 256
+        emulator.cycles -= 1
+        raise
     
         
 instructions = {
@@ -317,5 +333,79 @@ instructions = {
     0b11111: DUP,
 }
 
+# Per-opcode handlers for (no flags, mem_flag, stack_flag, mem_flag and stack_flag)
+specialised = {
+    0b00001: (LDA, LDA_mem, LDA_stack, LDA_stack_mem),
+    0b00010: (LDB, LDB_mem, LDB_stack, LDB_stack_mem),
+    0b00011: (FREE, FREE_mem, FREE, FREE_mem),
+    0b00111: (PRX, PRX_mem, PRX_stack, PRX_mem),
+    0b01000: (JMP, JMP_mem, JMP, JMP_mem),
+    0b01001: (STA, STA, STA_stack, STA_stack),
+    0b01010: (STB, STB, STB_stack, STB_stack),
+    0b01011: (INC, INC, INC_stack, INC_stack),
+    0b01100: (DEC, DEC, DEC_stack, DEC_stack),
+    0b10001: (CALL, CALL, CALL_stack, CALL_stack),
+    0b10010: (RET, RET, RET_stack, RET_stack),
+    0b11011: (OFF, OFF_mem, OFF_stack, OFF_mem),
+    0b11110: (PRC, PRC, PRC_stack, PRC_stack),
+}
+
+# The unused bit 5 of the instruction byte with opcode 0 selects a memory bank,
+# with any other opcode it is ignored as before
+BANK_SELECT = 0b0010_0000
+bank_select = (BANK, BANK_mem, BANK_stack, BANK_mem)
+
+def is_bank_select(instruction_byte):
+    return instruction_byte & 0b0011_1111 == BANK_SELECT
+
+debug_formats = {
+    0b00001: debug_addr,
+    0b00010: debug_addr,
+    0b00011: debug_addr,
+    0b00100: debug_addr,
+    0b00111: debug_addr,
+    0b01000: debug_addr,
+    0b01001: debug_addr_store,
+    0b01010: debug_addr_store,
+    0b01011: debug_addr,
+    0b01100: debug_addr,
+    0b01101: debug_addr,
+    0b01111: debug_addr,
+    0b10001: debug_addr,
+    0b10010: debug_addr,
+    0b10011: debug_addr,
+    0b10100: debug_addr,
+    0b10110: debug_addr,
+    0b10111: debug_addr,
+    0b11000: debug_addr,
+    0b11001: debug_addr,
+    0b11010: debug_addr,
+    0b11011: debug_addr,
+}
+
+def build_dispatch_table(debug_instructions=False):
+    """Build a handler for every possible instruction byte, with the flag checks resolved up front."""
+    table = []
+    for instruction_byte in range(0, 256):
+        instruction = instruction_byte & 0b0001_1111
+        mem_flag = (instruction_byte & 0b1000_0000) >> 7
+        stack_flag = (instruction_byte & 0b0100_0000) >> 6
+        if instruction not in instructions:
+            table.append(None)
+            continue
+        handlers = specialised.get(instruction, (instructions[instruction],)*4)
+        name = instructions[instruction].__name__
+        if is_bank_select(instruction_byte):
+            handlers = bank_select
+            name = "BANK"
+        handler = handlers[mem_flag + 2*stack_flag]
+        if debug_instructions:
+            handler = debug_formats.get(instruction, debug)(name, handler)
+        table.append(handler)
+    return table
+
+dispatch = build_dispatch_table()
+debug_dispatch = build_dispatch_table(debug_instructions=True)
+
 class InstructionException(Exception):
     pass
\ No newline at end of file
@@ -0,0 +1,421 @@
+import re
+import functools
+
+from components.register import REGISTERS, REGISTER_START, INSTRUCTION_REGISTER, check_register
+from components.stack import overflow, underflow
+from components.instructions import is_bank_select
+
+# Instructions that end a basic block, they may change the instruction register
+TERMINATORS = {
+    0b00110, # HLT
+    0b01000, # JMP
+    0b01111, # JE
+    0b10001, # CALL
+    0b10010, # RET
+    0b10110, # JNE
+    0b10111, # JG
+    0b11000, # JL
+    0b11001, # JGE
+    0b11010, # JLE
+}
+
+# Predicate on the difference stored by the last CMP
+CONDITIONAL_JUMPS = {
+    0b01111: "not comparison", # JE
+    0b10110: "comparison", # JNE
+    0b10111: "comparison > 0", # JG
+    0b11000: "comparison < 0", # JL
+    0b11001: "comparison >= 0", # JGE
+    0b11010: "comparison <= 0", # JLE
+}
+
+# READ may have to run again after waiting for input, it is always left to the interpreter
+INTERPRETED = {0b00100}
+
+# Instructions whose slow path may write to the program
+STORES = {0b01001, 0b01010, 0b01011, 0b01100}
+
+MAX_BLOCK_LENGTH = 64
+MAX_REGION_BLOCKS = 32
+
+# Registers, the stack pointer and the last comparison are held in local variables while a block runs,
+# the instruction register is only set at the end
+LOCAL_REGISTERS = [name for address, name in sorted(REGISTERS.items()) if address != INSTRUCTION_REGISTER] + ["sp", "comparison"]
+ASSIGNED_REGISTER = re.compile(r"\b(reg_\w+|sp|comparison) (=|\+=|-=)")
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_source(source, start):
+    # Engines running the same program generate the same source, only compile it once
+    return compile(source, f"<hatch block {start}>", "exec")
+
+
+def stack_address(data):
+    return f"stack[sp-{data}]+reg_offset"
+
+def check_stack_operand(data):
+    # Only entries 1..sp down the stack are there to be read
+    if not data:
+        return ["raise underflow('Stack')"]
+    return [f"if sp < {data}:", "    raise underflow('Stack')"]
+
+def registers(next_address):
+    # The registers by address as the region holds them, the instruction register is already past the instruction
+    return [str(next_address) if address == INSTRUCTION_REGISTER else name for address, name in sorted(REGISTERS.items())]
+
+def read(address, next_address):
+    if isinstance(address, int):
+        if address < REGISTER_START:
+            return f"ram[{address}]"
+        elif address in REGISTERS:
+            return registers(next_address)[address - REGISTER_START]
+        return f"read({address})"
+    # Memory.read would return the engine's registers, which are out of date while the region runs
+    return (f"(ram[address] if address < {REGISTER_START} "
+            f"else ({', '.join(registers(next_address))})[address-{REGISTER_START}] if address <= 255 else read(address))")
+
+def write(address, value, code_end, next_address):
+    if isinstance(address, int) and code_end < address < REGISTER_START:
+        # A constant address outside the program needs no checks
+        return [f"ram[{address}] = {value}"]
+    # Stores to the program go through Memory.write so compiled code is invalidated
+    return [
+        f"address = {address}",
+        f"if {code_end} < address < {REGISTER_START}:",
+        f"    ram[address] = {value}",
+        f"else:",
+        f"    emulator.instruction_register = {next_address}",
+        f"    write(address, {value})",
+    ]
+
+def load(register, name, mem_flag, stack_flag, data, next_address):
+    if mem_flag and stack_flag:
+        return [f"{register} = check_register('{name}', {stack_address(data)})"]
+    elif mem_flag:
+        return [f"address = {data}+reg_offset", f"{register} = {read('address', next_address)}"]
+    elif stack_flag:
+        return [f"address = {stack_address(data)}", f"{register} = {read('address', next_address)}"]
+    return [f"{register} = {data}"]
+
+def step(amount, stack_flag, data, code_end, next_address):
+    if not stack_flag and data in REGISTERS:
+        return [f"{REGISTERS[data]} = ({REGISTERS[data]} + {amount}) % 256"]
+    in_range = "ram[address] < 255" if amount > 0 else "ram[address] > 0"
+    return [
+        f"address = {stack_address(data) if stack_flag else data}",
+        f"if {code_end} < address < {REGISTER_START} and {in_range}:",
+        f"    ram[address] += {amount}",
+        f"else:",
+        # Memory.add steps the engine's registers, so they are synced around it
+        *[f"    {line}" for line in synced(f"add(address, {amount})", next_address)],
+    ]
+
+def mov(data):
+    into = REGISTERS.get(255-((data & 0b11110000) >> 4))
+    from_ = REGISTERS.get(255-(data & 0b1111))
+    if into is None or from_ is None:
+        return None
+    return [f"{into} = {from_}"]
+
+def generate(instruction, mem_flag, stack_flag, data, code_end, next_address):
+    """Python source lines for one instruction, or None if it has to go through its handler."""
+    if instruction == 0b00000: # NOP
+        return []
+    elif instruction == 0b00001: # LDA
+        return load("reg_a", "A", mem_flag, stack_flag, data, next_address)
+    elif instruction == 0b00010: # LDB
+        return load("reg_b", "B", mem_flag, stack_flag, data, next_address)
+    elif instruction == 0b00101: # ADD
+        return ["reg_a = (reg_a + reg_b) % 256"]
+    elif instruction == 0b01001: # STA
+        return write(stack_address(data) if stack_flag else data, "reg_a", code_end, next_address)
+    elif instruction == 0b01010: # STB
+        return write(stack_address(data) if stack_flag else data, "reg_b", code_end, next_address)
+    elif instruction == 0b01011: # INC
+        return step(1, stack_flag, data, code_end, next_address)
+    elif instruction == 0b01100: # DEC
+        return step(-1, stack_flag, data, code_end, next_address)
+    elif instruction == 0b01101: # MOV
+        return mov(data)
+    elif instruction == 0b01110: # CMP
+        return ["comparison = reg_a - reg_b"]
+    elif instruction == 0b10000: # NEG
+        return [
+            "reg_b = -reg_b & 0b11111111",
+            "reg_a = (reg_a + reg_b) % 256",
+        ]
+    elif instruction == 0b10100: # POP
+        return [
+            f"if sp < {data}:",
+            f"    raise underflow('Stack')",
+            f"sp -= {data}",
+            "while emulator.saved and emulator.saved[-1] >= sp:",
+            "    emulator.saved.pop()",
+        ]
+    elif instruction == 0b10101: # SAVE
+        return [
+            "if sp + 2 > len(stack):",
+            "    raise overflow('Stack', len(stack))",
+            "emulator.saved.append(sp)",
+            "stack[sp] = reg_a",
+            "stack[sp+1] = reg_b",
+            "sp += 2",
+        ]
+    elif instruction == 0b11011: # OFF
+        if mem_flag:
+            return [f"reg_offset = {read(data, next_address)}"]
+        elif stack_flag:
+            return [f"address = {stack_address(data)}", f"reg_offset = {read('address', next_address)}"]
+        return [f"reg_offset = {data}"]
+    elif instruction == 0b11100: # MUL
+        return ["reg_a = (reg_a * reg_b) % 256"]
+    elif instruction == 0b11101: # DIV
+        return ["reg_a = reg_a // reg_b"]
+    elif instruction == 0b11111: # DUP
+        return [
+            "if sp == len(stack):",
+            "    raise overflow('Stack', len(stack))",
+            f"stack[sp] = stack[sp-{data}]",
+            "sp += 1",
+        ]
+    return None
+
+def synced(call, next_address):
+    # Handlers work on the engine, so registers are written back before and reloaded after,
+    # even if the handler raises after changing some of them
+    return [
+        *[f"emulator.{register} = {register}" for register in LOCAL_REGISTERS],
+        f"emulator.instruction_register = {next_address}",
+        "try:",
+        f"    {call}",
+        "finally:",
+        f"    {', '.join(LOCAL_REGISTERS)} = {', '.join('emulator.' + register for register in LOCAL_REGISTERS)}",
+    ]
+
+def call_handler(name, mem_flag, stack_flag, data, next_address):
+    return synced(f"{name}(emulator, {mem_flag}, {stack_flag}, {data})", next_address)
+
+def touches_instruction_register(instruction, mem_flag, stack_flag, data):
+    # The instruction register is only brought up to date at the end of a block
+    if instruction == 0b01101:
+        return INSTRUCTION_REGISTER in (255-((data & 0b11110000) >> 4), 255-(data & 0b1111))
+    return not stack_flag and data == INSTRUCTION_REGISTER
+
+
+class BlockCompiler:
+    """
+    Tiered execution for OctoEngine. Blocks are straight runs of instructions
+    from the address control arrives at up to the next jump, call, return or
+    halt. Each entry into a block is counted, and once a block has been entered
+    hot_threshold times it is compiled, together with the blocks reachable from
+    it through immediate jumps, into a single Python function. Loops then run
+    inside that function without going through the dispatch table, with the
+    registers held in local variables until control leaves the region.
+    Nothing is counted until the engine has run warmup cycles, so short runs
+    are interpreted without paying for compilation.
+    """
+    def __init__(self, emulator, hot_threshold=10, warmup=10000):
+        self.emulator = emulator
+        self.hot_threshold = hot_threshold
+        self.warmup = warmup
+        self.terminating_handlers = {handler for instruction_byte, handler in enumerate(emulator.dispatch) if instruction_byte & 0b0001_1111 in TERMINATORS}
+        self.reset()
+
+    def reset(self):
+        self.counts = [0 for i in range(0, 256)]
+        self.blocks = [None for i in range(0, 256)]
+        # Block start addresses to drop when the byte at an address is written
+        self.covering = [[] for i in range(0, 256)]
+
+    def find_block(self, start):
+        """List of (address, instruction_byte, data) making up the block starting at start."""
+        code = self.emulator.code
+        program_end = self.emulator.program_end
+        block = []
+        address = start
+        while address + 1 < program_end and len(block) < MAX_BLOCK_LENGTH:
+            instruction_byte = code[address]
+            data = code[address+1]
+            instruction = instruction_byte & 0b0001_1111
+            if instruction in INTERPRETED or is_bank_select(instruction_byte) or touches_instruction_register(instruction, instruction_byte >> 7, (instruction_byte >> 6) & 1, data):
+                break
+            block.append((address, instruction_byte, data))
+            if instruction in TERMINATORS:
+                break
+            address += 2
+        return block
+
+    def find_region(self, start):
+        """Blocks reachable from start through fall through and immediate jumps, keyed by start address."""
+        region = {}
+        pending = [start]
+        while pending and len(region) < MAX_REGION_BLOCKS:
+            address = pending.pop()
+            if address in region:
+                continue
+            block = self.find_block(address)
+            if not block:
+                continue
+            region[address] = block
+            last_address, instruction_byte, data = block[-1]
+            instruction = instruction_byte & 0b0001_1111
+            if instruction in CONDITIONAL_JUMPS:
+                pending += [(last_address + 2) % 256, data]
+            elif instruction == 0b01000 and not instruction_byte >> 7:
+                pending.append(data)
+            elif instruction not in TERMINATORS:
+                pending.append((last_address + 2) % 256)
+        return region
+
+    def compile(self, start):
+        region = self.find_region(start)
+        if not region:
+            # Nothing worth compiling here, keep interpreting without trying again
+            self.blocks[start] = False
+            return False
+        dispatch = self.emulator.dispatch
+        # Stores at or below this may change the program
+        code_end = self.emulator.memory.code_end
+        # Source line of each instruction's code to (instruction register, cycles not run) if it raises there,
+        # as the interpreter would leave them. None is the instruction register a handler left
+        faults = {}
+        namespace = {"check_register": check_register, "overflow": overflow, "underflow": underflow, "blocks": self.blocks, "faults": faults}
+        # Leave the region if a store or handler invalidated it or changed the instruction register,
+        # giving back the cycles taken for the rest of the block
+        leave_if_invalidated = lambda next_address, unused: [
+            f"if blocks[{start}] is None or emulator.instruction_register != {next_address}:",
+            f"    pc = emulator.instruction_register",
+            f"    left += {unused}",
+            f"    break",
+        ]
+        header = [
+            "def region(emulator, budget):",
+            "    memory = emulator.memory",
+            "    ram, read, write, add = memory.memory, memory.read, memory.write, memory.add",
+            "    stack = emulator.stack",
+            f"    {', '.join(LOCAL_REGISTERS)} = {', '.join('emulator.' + register for register in LOCAL_REGISTERS)}",
+            f"    pc = {start}",
+            "    left = budget",
+            "    try:",
+            "        while True:",
+        ]
+        body = []
+        for block_start, block in sorted(region.items(), key=lambda item: item[0] != start):
+            body.append(f"{'if' if not body else 'elif'} pc == {block_start}:")
+            # Cycles are taken a block at a time, with too few left the interpreter runs it instead
+            lines = [f"if left < {len(block)}:", "    break", f"left -= {len(block)}"]
+            # Index in lines of the first line of each instruction, with where it leaves things if it raises
+            starts = []
+            for index, (address, instruction_byte, data) in enumerate(block):
+                unused = len(block) - index - 1
+                instruction = instruction_byte & 0b0001_1111
+                mem_flag = instruction_byte >> 7
+                stack_flag = (instruction_byte >> 6) & 1
+                next_address = (address + 2) % 256
+                starts.append((len(lines), next_address, unused))
+                if instruction == 0b01000 and not mem_flag: # JMP
+                    lines.append(f"pc = {data}")
+                    break
+                elif instruction in CONDITIONAL_JUMPS:
+                    lines.append(f"pc = {data} if {CONDITIONAL_JUMPS[instruction]} else {next_address}")
+                    break
+                elif instruction in TERMINATORS:
+                    namespace[f"handler_{address}"] = dispatch[instruction_byte]
+                    starts[-1] = (len(lines), None, unused)
+                    lines += call_handler(f"handler_{address}", mem_flag, stack_flag, data, next_address)
+                    lines.append("pc = emulator.instruction_register")
+                    lines.append("break")
+                    break
+                generated = generate(instruction, mem_flag, stack_flag, data, code_end, next_address)
+                if generated and any(f"stack[sp-{data}]" in line for line in generated):
+                    generated = check_stack_operand(data) + generated
+                if generated is None:
+                    namespace[f"handler_{address}"] = dispatch[instruction_byte]
+                    starts[-1] = (len(lines), None, unused)
+                    generated = call_handler(f"handler_{address}", mem_flag, stack_flag, data, next_address) + leave_if_invalidated(next_address, unused)
+                elif instruction in STORES and "else:" in generated:
+                    generated += [f"    {line}" for line in leave_if_invalidated(next_address, unused)]
+                lines += generated
+            else:
+                # Ran into the end of the block without a jump, carry on after it
+                lines.append(f"pc = {next_address}")
+            ends = [first for first, next_address, unused in starts[1:]] + [len(lines)]
+            for (first, next_address, unused), end in zip(starts, ends):
+                for line in range(first, end):
+                    faults[len(header) + len(body) + 1 + line] = (next_address, unused)
+            body += [f"    {line}" for line in lines]
+        body += ["else:", "    break"]
+
+        assigned = sorted({match.group(1) for line in body for match in ASSIGNED_REGISTER.finditer(line)})
+        source = "\n".join([
+            *header,
+            *[f"            {line}" for line in body],
+            "    except BaseException as exception:",
+            "        fault = faults.get(exception.__traceback__.tb_lineno)",
+            "        if fault is not None:",
+            "            next_address, unused = fault",
+            "            pc = emulator.instruction_register if next_address is None else next_address",
+            "            left += unused",
+            "        raise",
+            "    finally:",
+            "        emulator.instruction_register = pc",
+            "        emulator.cycles += budget - left",
+            *[f"        emulator.{register} = {register}" for register in assigned],
+            "    return left",
+        ])
+        exec(compile_source(source, start), namespace)
+        function = namespace["region"]
+
+        self.blocks[start] = function
+        for block in region.values():
+            for address, instruction_byte, data in block:
+                self.covering[address].append(start)
+                self.covering[address+1].append(start)
+        return function
+
+    def invalidate(self, address):
+        for start in self.covering[address]:
+            self.blocks[start] = None
+            self.counts[start] = 0
+        self.covering[address] = []
+
+    def run(self, cycles):
+        """Run at most cycles instructions, stopping early if the program halts. Returns the cycles left over."""
+        emulator = self.emulator
+        decoded = emulator.decoded
+        blocks = self.blocks
+        counts = self.counts
+        terminating_handlers = self.terminating_handlers
+        left = cycles
+        # Regions add the cycles they run to emulator.cycles themselves, interpreted ones are added from here
+        counted = cycles
+        # Cycles still to interpret before blocks are counted
+        cold = self.warmup - emulator.cycles
+        try:
+            while left and not emulator.halted:
+                if cycles - left >= cold:
+                    start = emulator.instruction_register
+                    counts[start] += 1
+                    block = blocks[start]
+                    if block is None and counts[start] >= self.hot_threshold:
+                        block = self.compile(start)
+                    if block:
+                        emulator.cycles += counted - left
+                        # The region counts the cycles it runs itself, even if it raises
+                        counted = left
+                        counted = remaining = block(emulator, left)
+                        if remaining != left:
+                            left = remaining
+                            continue
+                # Interpret up to and including the next block terminator
+                while left and not emulator.halted:
+                    address = emulator.instruction_register
+                    handler, mem_flag, stack_flag, data = decoded[address] or emulator.decode(address)
+                    emulator.instruction_register = (address + 2) % 256
+                    left -= 1
+                    handler(emulator, mem_flag, stack_flag, data)
+                    if handler in terminating_handlers:
+                        break
+        finally:
+            emulator.cycles += counted - left
+        return left
@@ -0,0 +1,9 @@
+class LimitException(Exception):
+    """A run went over one of the limits set on its engine (max_cycles, max_heap or max_call_depth)."""
+    def __init__(self, resource, limit):
+        super().__init__(resource, limit)
+        self.resource = resource
+        self.limit = limit
+
+    def __str__(self):
+        return f"{self.resource} limit of {self.limit} exceeded"
@@ -1,47 +1,104 @@
-from components.register import Register
-import itertools
+from components.register import REGISTERS, REGISTER_START
 
 class MemoryAccessException(Exception):
     pass
 
+# End of the heap, and of the window of each memory bank
+HEAP_END = 256-16
+
 class Memory:
-    def __init__(self, vm):
+    """
+    The 256 addressable bytes. With more than one bank, the heap window from
+    the end of the program (or of the data in Harvard mode) up to HEAP_END is bank switched: each bank has
+    its own window and heap bitmap, and selecting a bank swaps them in place.
+    The program, the reserved bytes and the registers are shared by all banks.
+    """
+    __slots__ = ("vm", "memory", "code_end", "bank", "banks")
+
+    def __init__(self, vm, banks=1):
         self.vm = vm
-        self.memory = [0 for i in range(0, 256)]
-        self.reserved = {}
-        
-    def reserve(self, addr, register):
-        self.reserved[addr] = register
-        
+        self.memory = bytearray(256)
+        # Writes up to here may change the program, -1 when it is in a separate code space
+        self.code_end = 0
+        self.bank = 0
+        # (window, heap bitmap) of every bank, the selected bank's entry is stale until it is switched out
+        self.banks = [(b"", 0) for i in range(0, banks)]
+
+    def load(self, code):
+        # Checked by ProgramImage
+        self.memory[0:len(code)] = code
+
+    def reset_banks(self):
+        """Empty every bank's window and select bank 0, called once the program is loaded."""
+        self.bank = 0
+        self.banks = [(bytes(max(0, HEAP_END - self.vm.heap.start)), 0) for bank in self.banks]
+
+    def select_bank(self, bank):
+        if not 0 <= bank < len(self.banks):
+            raise MemoryAccessException(f"No memory bank {bank} ({len(self.banks)} banks)")
+        if bank == self.bank:
+            return
+        heap = self.vm.heap
+        start = heap.start
+        self.banks[self.bank] = (bytes(self.memory[start:HEAP_END]), heap.occupied)
+        window, heap.occupied = self.banks[bank]
+        self.memory[start:HEAP_END] = window
+        self.bank = bank
+
+    def saved_banks(self):
+        """(window, heap bitmap) of every bank for a snapshot, with an empty entry for the selected one as its window is in memory."""
+        return tuple(self.banks[:self.bank]) + ((b"", 0),) + tuple(self.banks[self.bank+1:])
+
+    def restore_banks(self, bank, banks):
+        """Put back the banks of a snapshot, after the heap has been reset."""
+        self.reset_banks()
+        self.banks[:len(banks)] = banks
+        self.banks[bank] = (b"", 0)
+        self.bank = bank
+
+    def read(self, index):
+        # Addresses are always non-negative ints when they come from instructions
+        if index < REGISTER_START:
+            return self.memory[index]
+        if index > 255:
+            raise MemoryAccessException("Out of bounds memory access")
+        return getattr(self.vm, REGISTERS[index])
+
+    def write(self, index, value):
+        try:
+            self.memory[index] = value
+        except IndexError:
+            raise MemoryAccessException(f"Out of bounds memory access (at byte {index})")
+        except ValueError:
+            raise MemoryAccessException(f"Tried to store an out of bounds value in memory address {index} ({value.__class__.__name__}: {value})")
+        # Only the loaded program is predecoded
+        if index <= self.code_end:
+            self.vm.invalidate(index)
+
+    def add(self, index, amount):
+        # Registers wrap around, plain memory refuses to overflow
+        if REGISTER_START <= index <= 255:
+            register = REGISTERS[index]
+            setattr(self.vm, register, (getattr(self.vm, register) + amount) % 256)
+        else:
+            self.write(index, self.read(index) + amount)
 
     def __getitem__(self, index):
-        if not isinstance(index, (int, Register)):
+        if not isinstance(index, int):
             raise MemoryAccessException(f"Non integer access to memory ({index.__class__.__name__}: {index})")
-        if type(index) is Register:
-            index = index.value
         if not 0 <= index <= 255:
             raise MemoryAccessException("Out of bounds memory access")
-        if index in self.reserved:
-            return self.reserved[index]
-        return self.memory[index]
+        return self.read(index)
     
     def __setitem__(self, index, value):
         if not isinstance(index, int):
             raise MemoryAccessException(f"Non integer access to memory ({index.__class__.__name__}: {index})")
-        #if index in self.reserved:
-        #    raise MemoryAccessException(f"Accessing reserved memory ({index})")
         if not 0 <= index <= 255:
             raise MemoryAccessException(f"Out of bounds memory access (at byte {index})")
-        
-        if not isinstance(value, (int, Register)):
-            raise MemoryAccessException(f"Tried to store a non int/register in memory ({value.__class__.__name__}: {value})")
-        if isinstance(value, Register):
-            value = value.value
-        if not 0 <= value <= 255:
-            raise MemoryAccessException(f"Tried to store an out of bounds value in memory address {index} ({value.__class__.__name__}: {value})")
-
-        self.memory[index] = value
+        if not isinstance(value, int):
+            raise MemoryAccessException(f"Tried to store a non int in memory ({value.__class__.__name__}: {value})")
+        self.write(index, value)
         
     def __repr__(self):
         # Print memory up to unused zeroes
-        return f"<Memory: {list(reversed(list(itertools.dropwhile(lambda x: x == 0, reversed(self.memory)))))}>"
\ No newline at end of file
+        return f"<Memory: {list(self.memory.rstrip(bytes([0])))}>"
@@ -0,0 +1,121 @@
+import abc
+import os
+import sys
+
+class OutputSink:
+    """
+    Destination for the output of PRX and PRC. OctoEngine writes to every sink
+    in its sinks list, and flushes them when the program halts, the run ends or
+    READ is about to wait for input.
+    """
+    def write_number(self, value):
+        # PRX
+        pass
+
+    def write_char(self, byte):
+        # PRC
+        pass
+
+    def end_line(self):
+        # PRC with a literal newline, used by io.print to finish a line
+        self.write_char(10)
+
+    def flush(self):
+        pass
+
+
+class ListSink(OutputSink):
+    """Records numbers as ints and characters as strings, this is OctoEngine.output."""
+    def __init__(self, output):
+        self.output = output
+
+    def write_number(self, value):
+        self.output.append(value)
+
+    def write_char(self, byte):
+        self.output.append(str(bytes([byte,]), "utf8"))
+
+    def end_line(self):
+        # Line breaks are presentation only, they are not part of the recorded output
+        pass
+
+
+class BytesSink(OutputSink):
+    """Collects the output as it would be printed in a bytearray."""
+    def __init__(self):
+        self.data = bytearray()
+
+    def write_number(self, value):
+        self.data += b"%d" % value
+
+    def write_char(self, byte):
+        self.data.append(byte)
+
+
+class BufferedSink(OutputSink, metaclass=abc.ABCMeta):
+    """Collects output in a buffer and passes it on in chunks once more than threshold bytes are waiting."""
+    def __init__(self, threshold=4096):
+        self.buffer = bytearray()
+        self.threshold = threshold
+
+    def write_number(self, value):
+        self.buffer += b"%d" % value
+        if len(self.buffer) > self.threshold:
+            self.flush()
+
+    def write_char(self, byte):
+        self.buffer.append(byte)
+        if len(self.buffer) > self.threshold:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.emit(bytes(self.buffer))
+            self.buffer.clear()
+
+    @abc.abstractmethod
+    def emit(self, chunk):
+        pass
+
+
+class FileSink(BufferedSink):
+    """Writes the output to a file descriptor, one write per chunk instead of one per character."""
+    def __init__(self, fd=1, threshold=4096):
+        super().__init__(threshold)
+        self.fd = fd
+
+    def emit(self, chunk):
+        view = memoryview(chunk)
+        while view:
+            view = view[os.write(self.fd, view):]
+
+
+class StdoutSink(BufferedSink):
+    """
+    Writes the output to sys.stdout as it is when each chunk is written, so
+    it follows redirect_stdout and stays in order with anything print()ed.
+    """
+    def emit(self, chunk):
+        stdout = sys.stdout
+        # Text printed before this chunk goes out first
+        stdout.flush()
+        buffer = getattr(stdout, "buffer", None)
+        if buffer is None:
+            # A text only stream, such as an io.StringIO
+            stdout.write(chunk.decode("utf8", "replace"))
+        else:
+            buffer.write(chunk)
+
+    def flush(self):
+        super().flush()
+        sys.stdout.flush()
+
+
+class StreamSink(BufferedSink):
+    """Keeps flushed chunks for OctoEngine.stream() to yield."""
+    def __init__(self, threshold=0):
+        super().__init__(threshold)
+        self.chunks = []
+
+    def emit(self, chunk):
+        self.chunks.append(chunk)
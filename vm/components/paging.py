@@ -0,0 +1,227 @@
+import mmap
+from collections import OrderedDict
+
+from components.memory import Memory, MemoryAccessException, HEAP_END
+
+POLICIES = ("lru", "clock")
+
+class PageCache:
+    """
+    Fixed size pages held in a backing store, a bytearray or a memory mapped
+    file given by path, behind a cache of at most frames pages. Reading a
+    page that is not cached reads it from the store. When the cache is full a
+    page is evicted by policy, least recently used ("lru") or the first
+    without its reference bit set ("clock"), and written back to the store
+    if it was changed.
+    """
+    def __init__(self, frames=64, page_size=16, path=None, policy="lru"):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown page replacement policy {policy!r}, expected one of {', '.join(POLICIES)}")
+        if frames < 1 or page_size < 1:
+            raise ValueError("A page cache needs at least one frame of at least one byte")
+        self.frames = frames
+        self.page_size = page_size
+        self.path = path
+        self.policy = policy
+        self.file = None
+        self.store = bytearray()
+        # Cached pages in eviction order, the front is evicted first
+        self.cache = OrderedDict()
+        self.dirty = set()
+        # Clock reference bits of the cached pages
+        self.referenced = set()
+        # Pages read from the cache and from the store
+        self.cache_reads = 0
+        self.store_reads = 0
+        self.evictions = 0
+        self.writebacks = 0
+
+    def empty_copy(self):
+        """A new cache with the same settings, backed by a bytearray so the two never share a file."""
+        return PageCache(self.frames, self.page_size, None, self.policy)
+
+    def reset(self, pages):
+        """Make a zeroed store of pages pages, dropping the cache and counters."""
+        self.close()
+        size = pages * self.page_size
+        if self.path is None:
+            self.store = bytearray(size)
+        else:
+            self.file = open(self.path, "w+b")
+            self.file.truncate(size)
+            # mmap refuses empty files
+            self.store = mmap.mmap(self.file.fileno(), size) if size else bytearray()
+        self.cache.clear()
+        self.dirty.clear()
+        self.referenced.clear()
+        self.cache_reads = 0
+        self.store_reads = 0
+        self.evictions = 0
+        self.writebacks = 0
+
+    def touch(self, page):
+        if self.policy == "lru":
+            self.cache.move_to_end(page)
+        else:
+            self.referenced.add(page)
+
+    def evict(self):
+        while True:
+            page = next(iter(self.cache))
+            if page in self.referenced:
+                # Second chance, go round again once the rest have been looked at
+                self.referenced.discard(page)
+                self.cache.move_to_end(page)
+                continue
+            data = self.cache.pop(page)
+            if page in self.dirty:
+                self.dirty.discard(page)
+                self.store[page*self.page_size:page*self.page_size+len(data)] = data
+                self.writebacks += 1
+            self.evictions += 1
+            return
+
+    def insert(self, page, data):
+        if len(self.cache) >= self.frames:
+            self.evict()
+        self.cache[page] = data
+
+    def read(self, page):
+        data = self.cache.get(page)
+        if data is not None:
+            self.cache_reads += 1
+            self.touch(page)
+            return data
+        self.store_reads += 1
+        data = bytes(self.store[page*self.page_size:(page+1)*self.page_size])
+        self.insert(page, data)
+        return data
+
+    def write(self, page, data):
+        """Replace the start of a page with data, written back to the store when it is evicted or flushed."""
+        data = bytes(data) + self.peek(page)[len(data):]
+        if page in self.cache:
+            self.cache[page] = data
+            self.touch(page)
+        else:
+            self.insert(page, data)
+        self.dirty.add(page)
+
+    def peek(self, page):
+        """A page's bytes without counting an access or changing the cache."""
+        data = self.cache.get(page)
+        if data is None:
+            data = bytes(self.store[page*self.page_size:(page+1)*self.page_size])
+        return data
+
+    def flush(self):
+        """Write every dirty page back to the store."""
+        for page in sorted(self.dirty):
+            data = self.cache[page]
+            self.store[page*self.page_size:page*self.page_size+len(data)] = data
+            self.writebacks += 1
+        self.dirty.clear()
+        if self.file is not None:
+            self.store.flush()
+
+    @property
+    def cache_read_rate(self):
+        reads = self.cache_reads + self.store_reads
+        return self.cache_reads / reads if reads else 0.0
+
+    def stats(self):
+        return {
+            "cache_reads": self.cache_reads, "store_reads": self.store_reads, "cache_read_rate": self.cache_read_rate,
+            "evictions": self.evictions, "writebacks": self.writebacks, "cached": len(self.cache),
+        }
+
+    def close(self):
+        if self.file is not None:
+            self.flush()
+            self.store.close()
+            self.file.close()
+            self.file = None
+
+
+class BankStoreMemory(Memory):
+    """
+    Memory whose banks live in a PageCache rather than in Python bytes, so
+    there can be far more of them than fit in memory at once. Each bank's
+    window is split into pages; selecting a bank hands the pages of the
+    current window that changed to the cache and copies in every page of the
+    new one. Pages only move when a bank is selected, there is no paging on
+    access: instructions read and write the 256 physical bytes directly.
+    """
+    __slots__ = ("pages", "mapped", "pages_per_bank")
+
+    def __init__(self, vm, banks, pages):
+        super().__init__(vm, banks)
+        self.pages = pages
+        # Contents of the selected bank's pages as they were mapped in, to find the ones written since
+        self.mapped = []
+        self.pages_per_bank = 0
+        # Heap bitmap of every bank, their windows are in the page cache
+        self.banks = [0 for i in range(0, banks)]
+
+    def page_ranges(self):
+        start = self.vm.heap.start
+        size = self.pages.page_size
+        return [(address, min(address + size, HEAP_END)) for address in range(start, HEAP_END, size)]
+
+    def reset_banks(self):
+        self.bank = 0
+        self.pages_per_bank = len(self.page_ranges())
+        self.pages.reset(len(self.banks) * self.pages_per_bank)
+        self.banks = [0 for bank in self.banks]
+        # Bank 0's pages start out zeroed in the store, any bytes already in the window are written back as changes
+        self.mapped = [bytes(end - start) for start, end in self.page_ranges()]
+
+    def map_out(self):
+        first = self.bank * self.pages_per_bank
+        for i, (start, end) in enumerate(self.page_ranges()):
+            window = self.memory[start:end]
+            if window != self.mapped[i]:
+                self.pages.write(first + i, window)
+
+    def select_bank(self, bank):
+        if not 0 <= bank < len(self.banks):
+            raise MemoryAccessException(f"No memory bank {bank} ({len(self.banks)} banks)")
+        if bank == self.bank:
+            return
+        heap = self.vm.heap
+        self.map_out()
+        self.banks[self.bank] = heap.occupied
+        heap.occupied = self.banks[bank]
+        first = bank * self.pages_per_bank
+        for i, (start, end) in enumerate(self.page_ranges()):
+            data = self.pages.read(first + i)[:end - start]
+            self.memory[start:end] = data
+            self.mapped[i] = data
+        self.bank = bank
+
+    def saved_banks(self):
+        saved = []
+        for bank, occupied in enumerate(self.banks):
+            if bank == self.bank:
+                saved.append((b"", 0))
+                continue
+            first = bank * self.pages_per_bank
+            window = b"".join(self.pages.peek(first + i)[:end - start] for i, (start, end) in enumerate(self.page_ranges()))
+            saved.append((window, occupied))
+        return tuple(saved)
+
+    def restore_banks(self, bank, banks):
+        self.reset_banks()
+        for number, (window, occupied) in enumerate(banks):
+            if number == bank:
+                continue
+            first = number * self.pages_per_bank
+            start = self.vm.heap.start
+            for i, (page_start, page_end) in enumerate(self.page_ranges()):
+                data = window[page_start - start:page_end - start]
+                if any(data):
+                    self.pages.write(first + i, data)
+            self.banks[number] = occupied
+        self.bank = bank
+        # The selected bank's pages in the store are still zeroed, so every changed page of the window is written back
+        self.mapped = [bytes(end - start) for start, end in self.page_ranges()]
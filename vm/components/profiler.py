@@ -0,0 +1,186 @@
+import os
+import struct
+
+from components.hooks import Tracer
+from components.allocator import bit_count
+from components.instructions import instructions
+
+def function_name(name):
+    """Readable name for a function_addresses key, 'triangle_number###|int|main.hatch' becomes 'triangle_number'."""
+    name, _, signature = name.partition("###")
+    filename = signature.split("|")[-1]
+    module = os.path.splitext(os.path.basename(filename))[0]
+    if module and module != "main":
+        return f"{module}.{name}"
+    return name
+
+
+class Profiler(Tracer):
+    """
+    Counts the instructions run per opcode and per address, and the cycles
+    spent in each Hatch function by following CALL and RET. Functions are
+    named from the function_addresses returned by hc.compile(..., debug=True),
+    calls to any other address are named by the address.
+
+        instructions, function_addresses, data_start = hc.compile(source, debug=True)
+        profiler = Profiler(function_addresses)
+        virtual_machine = OctoEngine(tracers=[profiler])
+    """
+    def __init__(self, function_addresses=None):
+        self.names = {address: function_name(name) for name, address in (function_addresses or {}).items()}
+        self.opcodes = [0 for i in range(0, 32)]
+        self.addresses = [0 for i in range(0, 256)]
+        # Cycles run with each call stack, from the outermost function in
+        self.stacks = {}
+        self.stack = (self.name(0),)
+
+    def name(self, address):
+        return self.names.get(address, f"0x{address:02x}")
+
+    def on_instruction(self, emulator, address, instruction, data):
+        self.opcodes[instruction & 0b0001_1111] += 1
+        self.addresses[address] += 1
+        self.stacks[self.stack] = self.stacks.get(self.stack, 0) + 1
+
+    def on_call(self, emulator, return_address, target):
+        self.stack += (self.name(target),)
+
+    def on_ret(self, emulator, return_address):
+        if len(self.stack) > 1:
+            self.stack = self.stack[:-1]
+
+    @property
+    def cycles(self):
+        return sum(self.stacks.values())
+
+    def functions(self):
+        """{name: (inclusive, exclusive)} cycles, a recursive function's inclusive cycles are counted once."""
+        inclusive = {}
+        exclusive = {}
+        for stack, cycles in self.stacks.items():
+            exclusive[stack[-1]] = exclusive.get(stack[-1], 0) + cycles
+            for name in set(stack):
+                inclusive[name] = inclusive.get(name, 0) + cycles
+        return {name: (inclusive[name], exclusive.get(name, 0)) for name in inclusive}
+
+    def folded(self):
+        """Folded stacks, one 'outer;inner cycles' line per call stack, for flamegraph.pl and similar tools."""
+        return "".join(f"{';'.join(stack)} {cycles}\n" for stack, cycles in sorted(self.stacks.items()))
+
+    def table(self, limit=10):
+        """Top functions by exclusive cycles and top opcodes by count, as text."""
+        total = self.cycles or 1
+        lines = [f"{'function':<24} {'inclusive':>10} {'exclusive':>10} {'%':>6}"]
+        functions = sorted(self.functions().items(), key=lambda item: item[1][1], reverse=True)
+        for name, (inclusive, exclusive) in functions[:limit]:
+            lines.append(f"{name:<24} {inclusive:>10} {exclusive:>10} {exclusive*100/total:>6.1f}")
+        lines.append("")
+        lines.append(f"{'opcode':<24} {'count':>10} {'%':>6}")
+        opcodes = sorted(range(0, 32), key=lambda opcode: self.opcodes[opcode], reverse=True)
+        for opcode in opcodes[:limit]:
+            if self.opcodes[opcode]:
+                lines.append(f"{instructions[opcode].__name__:<24} {self.opcodes[opcode]:>10} {self.opcodes[opcode]*100/total:>6.1f}")
+        return "\n".join(lines) + "\n"
+
+
+# Cycle, size, kind, code address, heap address, live bytes after the event
+EVENT = struct.Struct("<QHBBBB")
+PUSH = 0
+FREE = 1
+
+class HeapProfiler(Tracer):
+    """
+    Records PUSH and FREE events in a ring buffer of the last capacity
+    events, and follows the live heap bytes, their peak and how fragmented
+    the free space is. Blocks still allocated when HLT runs are kept in
+    leaks as (address, size, code address, cycle) of the PUSH that made them.
+    """
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.buffer = bytearray(EVENT.size * capacity)
+        self.count = 0
+        self.peak = 0
+        self.worst_fragmentation = 0.0
+        # Allocated blocks by address, as (size, code address, cycle)
+        self.blocks = {}
+        self.leaks = None
+
+    def record(self, emulator, kind, address, length):
+        live = emulator.heap.live_bytes
+        self.peak = max(self.peak, live)
+        self.worst_fragmentation = max(self.worst_fragmentation, fragmentation(emulator.heap))
+        # The instruction register has already moved past the instruction
+        code_address = (emulator.instruction_register - 2) % 256
+        EVENT.pack_into(self.buffer, (self.count % self.capacity) * EVENT.size, emulator.cycles, length, kind, code_address, address, live)
+        self.count += 1
+        return code_address
+
+    def on_push(self, emulator, address, length):
+        # Zero length allocations still take a byte
+        length = max(length, 1)
+        code_address = self.record(emulator, PUSH, address, length)
+        self.blocks[address] = (length, code_address, emulator.cycles)
+
+    def on_free(self, emulator, address, length):
+        self.record(emulator, FREE, address, length)
+        heap = emulator.heap
+        for start, (size, code_address, cycle) in list(self.blocks.items()):
+            if start < address + length and address < start + size and all(heap.is_free(i) for i in range(start, start + size)):
+                del self.blocks[start]
+
+    def on_compact(self, emulator, moves):
+        blocks = {}
+        for start, block in self.blocks.items():
+            for address, destination, length in moves:
+                if address <= start < address + length:
+                    start += destination - address
+                    break
+            blocks[start] = block
+        self.blocks = blocks
+
+    def on_instruction(self, emulator, address, instruction, data):
+        if instruction & 0b0001_1111 == 0b00110: # HLT
+            self.leaks = self.leaked(emulator)
+
+    def leaked(self, emulator):
+        """Blocks with bytes that are still allocated."""
+        heap = emulator.heap
+        return [
+            (start, size, code_address, cycle) for start, (size, code_address, cycle) in sorted(self.blocks.items())
+            if not all(heap.is_free(i) for i in range(start, start + size))
+        ]
+
+    def events(self):
+        """(cycle, kind, code address, heap address, size, live bytes) for the recorded events, oldest first."""
+        first = max(0, self.count - self.capacity)
+        events = []
+        for i in range(first, self.count):
+            cycle, size, kind, code_address, address, live = EVENT.unpack_from(self.buffer, (i % self.capacity) * EVENT.size)
+            events.append((cycle, "PUSH" if kind == PUSH else "FREE", code_address, address, size, live))
+        return events
+
+    def timeline(self):
+        """(cycle, live bytes) after each recorded event."""
+        return [(event[0], event[5]) for event in self.events()]
+
+    def stats(self, emulator):
+        heap = emulator.heap
+        return {
+            "events": self.count,
+            "live_bytes": heap.live_bytes,
+            "peak": self.peak,
+            "heap_size": bit_count(heap.heap),
+            "free_bytes": heap.free_bytes,
+            "largest_free_run": heap.largest_free_run,
+            "fragmentation": fragmentation(heap),
+            "worst_fragmentation": self.worst_fragmentation,
+            "leaks": self.leaks if self.leaks is not None else self.leaked(emulator),
+        }
+
+
+def fragmentation(heap):
+    """1 - largest free run / free bytes, 0 when all the free space is in one run."""
+    free = heap.free_bytes
+    if not free:
+        return 0.0
+    return 1 - heap.largest_free_run / free
@@ -0,0 +1,146 @@
+import os
+import time
+import functools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from components.image import ProgramImage
+from components.output import ListSink, BytesSink
+
+# Most programs each worker process keeps loaded, so a program run many times is read or compiled once per worker.
+# Worker threads share them
+IMAGE_CACHE_SIZE = 64
+
+class CompileException(Exception):
+    pass
+
+def load_program(program):
+    """ProgramImage for a ProgramImage, program bytes, or the path of a .hb file or .hatch source file."""
+    if isinstance(program, ProgramImage):
+        return program
+    if isinstance(program, str):
+        # A file changed since it was loaded is loaded again
+        return load_image(program, os.stat(program).st_mtime_ns)
+    return load_image(bytes(program), None)
+
+@functools.lru_cache(maxsize=IMAGE_CACHE_SIZE)
+def load_image(program, modified):
+    if isinstance(program, str) and program.endswith(".hatch"):
+        # Needs compiler/hc on sys.path, which the vm does not otherwise depend on
+        import hc
+        try:
+            return ProgramImage(hc.compile_file(program, False))
+        except SystemExit:
+            # The compiler prints the error and exits, here only the run fails
+            raise CompileException(f"Could not compile {program}") from None
+    elif isinstance(program, str):
+        with open(program, "rb") as program_file:
+            return ProgramImage(program_file.read())
+    return ProgramImage(program)
+
+class RunResult:
+    """Outcome of one run, output as in OctoEngine.output and printed as the bytes it would have written to stdout."""
+    __slots__ = ("output", "printed", "halted", "cycles", "heap_peak", "call_depth", "error")
+
+    def __init__(self, output, printed, halted, cycles, heap_peak, call_depth, error):
+        self.output = output
+        self.printed = printed
+        self.halted = halted
+        self.cycles = cycles
+        self.heap_peak = heap_peak
+        self.call_depth = call_depth
+        self.error = error
+
+    def __repr__(self):
+        return f"<RunResult output={self.output} halted={self.halted} cycles={self.cycles} error={self.error!r}>"
+
+
+def run_one(run, limits=None):
+    """Run one (program, input) pair to completion in this process, limits are OctoEngine max_ arguments."""
+    # Imported here as vm imports this module
+    from vm import OctoEngine
+    program, input_data = run
+    output = []
+    printed = BytesSink()
+    emulator = OctoEngine(True, sinks=[ListSink(output), printed], input_source=bytes(input_data), **(limits or {}))
+    error = None
+    try:
+        emulator.load(load_program(program))
+        emulator.run()
+    except Exception as exception:
+        error = exception
+    usage = emulator.usage
+    return RunResult(output, bytes(printed.data), emulator.halted, usage["cycles"], usage["heap_peak"], usage["call_depth"], error)
+
+
+class BatchRunner:
+    """
+    Runs many (program, input) pairs across a pool of worker processes.
+    Results are yielded in the order the runs were given, as they finish,
+    and stats holds the totals for everything yielded so far.
+    """
+    executor = ProcessPoolExecutor
+
+    def __init__(self, jobs=None, chunksize=16, limits=None):
+        self.jobs = jobs or os.cpu_count() or 1
+        self.chunksize = chunksize
+        # For example {"max_cycles": 10**6, "max_call_depth": 64} to bound untrusted programs
+        self.limits = limits
+        self.stats = BatchStats()
+
+    def run(self, runs):
+        self.stats = stats = BatchStats()
+        start = time.perf_counter()
+        run = functools.partial(run_one, limits=self.limits)
+        if self.jobs == 1:
+            results = map(run, runs)
+            for result in results:
+                stats.add(result, time.perf_counter() - start)
+                yield result
+            return
+        with self.executor(self.jobs) as executor:
+            for result in executor.map(run, runs, chunksize=self.chunksize):
+                stats.add(result, time.perf_counter() - start)
+                yield result
+
+
+class ThreadBatchRunner(BatchRunner):
+    """
+    BatchRunner on a pool of threads. There is no process start up or
+    pickling and every thread shares the loaded images, but the runs only
+    execute in parallel on free threaded builds of Python.
+    """
+    executor = ThreadPoolExecutor
+
+
+class BatchStats:
+    __slots__ = ("runs", "cycles", "errors", "seconds")
+
+    def __init__(self):
+        self.runs = 0
+        self.cycles = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+    def add(self, result, seconds):
+        self.runs += 1
+        self.cycles += result.cycles
+        self.errors += result.error is not None
+        self.seconds = seconds
+
+    @property
+    def runs_per_second(self):
+        return self.runs / self.seconds if self.seconds else 0.0
+
+    @property
+    def cycles_per_second(self):
+        return self.cycles / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (f"{self.runs} runs ({self.errors} failed), {self.cycles} cycles in {self.seconds:.3f}s: "
+                f"{self.runs_per_second:.1f} runs/s, {self.cycles_per_second:.0f} cycles/s")
+
+
+def run_batch(program, inputs, jobs=None, chunksize=16, threads=False, limits=None):
+    """Run program once per input across jobs worker processes (or threads), yielding a RunResult for each input in order."""
+    runner = ThreadBatchRunner if threads else BatchRunner
+    return runner(jobs, chunksize, limits).run((program, input_data) for input_data in inputs)
@@ -0,0 +1,127 @@
+import struct
+
+class SnapshotException(Exception):
+    pass
+
+MAGIC = b"HSNP"
+VERSION = 2
+
+# Magic, version, memory, the six registers, halted, comparison, program_end, heap bitmap, compactions, bytes moved
+FIXED = struct.Struct("<4sB256s6B?hH32sII")
+LENGTH = struct.Struct("<I")
+# Selected memory bank and the number of banks, at the start of the banks section added in version 2
+BANKS = struct.Struct("<BB")
+
+# Tags for the values in OctoEngine.output
+NUMBER = 0
+CHAR = 1
+
+class Snapshot:
+    """
+    The state of an OctoEngine at one point in time, taken with
+    OctoEngine.snapshot() and put back with OctoEngine.restore(). The input
+    and output buffers are included, the input source and sinks are not.
+    """
+    __slots__ = (
+        "memory", "registers", "halted", "comparison", "program_end",
+        "heap", "compactions", "bytes_moved",
+        "stack", "call_stack", "saved", "output", "input", "bank", "banks",
+    )
+
+    def __init__(self, memory, registers, halted, comparison, program_end, heap, compactions, bytes_moved,
+                 stack, call_stack, saved, output, input, bank=0, banks=((b"", 0),)):
+        self.memory = memory
+        self.registers = registers
+        self.halted = halted
+        self.comparison = comparison
+        self.program_end = program_end
+        self.heap = heap
+        self.compactions = compactions
+        self.bytes_moved = bytes_moved
+        self.stack = stack
+        self.call_stack = call_stack
+        self.saved = saved
+        self.output = output
+        self.input = input
+        # Selected bank, and (window, heap bitmap) of every bank with an empty entry for the selected one
+        self.bank = bank
+        self.banks = banks
+
+    def to_bytes(self):
+        output = bytearray()
+        for value in self.output:
+            if isinstance(value, str):
+                output += bytes([CHAR, *value.encode("utf8")])
+            else:
+                output += bytes([NUMBER, value])
+        banks = bytearray(BANKS.pack(self.bank, len(self.banks)))
+        for window, occupied in self.banks:
+            banks += LENGTH.pack(len(window)) + window + occupied.to_bytes(32, "little")
+        sections = [
+            self.stack,
+            self.call_stack,
+            struct.pack(f"<{len(self.saved)}H", *self.saved),
+            output,
+            self.input,
+            banks,
+        ]
+        data = bytearray(FIXED.pack(
+            MAGIC, VERSION, self.memory, *self.registers, self.halted, self.comparison, self.program_end,
+            self.heap.to_bytes(32, "little"), self.compactions, self.bytes_moved,
+        ))
+        for section in sections:
+            data += LENGTH.pack(len(section))
+            data += section
+        return bytes(data)
+
+    @classmethod
+    def from_bytes(cls, data):
+        if len(data) < FIXED.size or data[:4] != MAGIC:
+            raise SnapshotException("Not a snapshot")
+        magic, version, memory, *fields = FIXED.unpack_from(data)
+        if version not in (1, VERSION):
+            raise SnapshotException(f"Unsupported snapshot version {version}")
+        registers = tuple(fields[:6])
+        halted, comparison, program_end, heap, compactions, bytes_moved = fields[6:]
+
+        sections = []
+        position = FIXED.size
+        # Version 1 snapshots have no banks section
+        for i in range(0, 5 if version == 1 else 6):
+            if position + LENGTH.size > len(data):
+                raise SnapshotException("Truncated snapshot")
+            length, = LENGTH.unpack_from(data, position)
+            position += LENGTH.size
+            if position + length > len(data):
+                raise SnapshotException("Truncated snapshot")
+            sections.append(bytes(data[position:position+length]))
+            position += length
+        stack, call_stack, saved, encoded_output, input = sections[:5]
+
+        bank, banks = 0, ((b"", 0),)
+        if version > 1:
+            try:
+                bank, count = BANKS.unpack_from(sections[5])
+                banks = []
+                offset = BANKS.size
+                for i in range(0, count):
+                    length, = LENGTH.unpack_from(sections[5], offset)
+                    offset += LENGTH.size
+                    window = sections[5][offset:offset+length]
+                    occupied = int.from_bytes(sections[5][offset+length:offset+length+32], "little")
+                    banks.append((window, occupied))
+                    offset += length + 32
+            except struct.error:
+                raise SnapshotException("Truncated snapshot")
+            banks = tuple(banks)
+        output = []
+        for i in range(0, len(encoded_output), 2):
+            tag, value = encoded_output[i], encoded_output[i+1]
+            output.append(chr(value) if tag == CHAR else value)
+
+        return cls(
+            memory, registers, halted, comparison, program_end,
+            int.from_bytes(heap, "little"), compactions, bytes_moved,
+            stack, call_stack, struct.unpack(f"<{len(saved)//2}H", saved), tuple(output), input,
+            bank, banks,
+        )
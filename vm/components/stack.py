@@ -0,0 +1,20 @@
+class StackException(Exception):
+    pass
+
+# Fixed capacities, the stacks never grow past these
+STACK_SIZE = 1024
+CALL_STACK_SIZE = 256
+
+def overflow(name, size):
+    return StackException(f"{name} overflow (more than {size} entries)")
+
+def underflow(name):
+    return StackException(f"{name} underflow")
+
+def stack_entry(emulator, data):
+    """The entry data places down an engine's stack, 1 being the top."""
+    sp = emulator.sp
+    # The stack is a fixed bytearray, so anything outside 1..sp would read a stale or wrapped around slot
+    if not 0 < data <= sp:
+        raise underflow("Stack")
+    return emulator.stack[sp-data]
@@ -0,0 +1,74 @@
+import mmap
+import struct
+
+from components.hooks import Tracer
+
+class TraceException(Exception):
+    pass
+
+MAGIC = b"HTRC"
+VERSION = 1
+
+# Magic, version, capacity in records
+HEADER = struct.Struct("<4sBI")
+# Cycle, instruction register, instruction byte, data, A, B, offset, stack depth
+RECORD = struct.Struct("<QBBBBBBH")
+
+class TraceRecorder(Tracer):
+    """
+    Writes a fixed size binary record of every instruction into a ring
+    buffer holding the last capacity of them, in memory or in a memory
+    mapped file given by path. Records are written before the instruction
+    runs, so after a crash the newest one is the instruction that raised.
+    Read them back with decode_trace(), or vm/tracedump.py to print them.
+    """
+    def __init__(self, capacity=65536, path=None):
+        self.capacity = capacity
+        size = HEADER.size + RECORD.size * capacity
+        self.file = None
+        if path is None:
+            self.buffer = bytearray(size)
+        else:
+            self.file = open(path, "w+b")
+            self.file.truncate(size)
+            self.buffer = mmap.mmap(self.file.fileno(), size)
+        HEADER.pack_into(self.buffer, 0, MAGIC, VERSION, capacity)
+        # Byte offset of the next record to write
+        self.offset = HEADER.size
+        self.end = size
+        self.pack_into = RECORD.pack_into
+
+    def on_instruction(self, emulator, address, instruction, data):
+        offset = self.offset
+        # Cycles count from 1, so a zeroed record was never written
+        self.pack_into(
+            self.buffer, offset, emulator.cycles + 1, address, instruction, data,
+            emulator.reg_a, emulator.reg_b, emulator.reg_offset, emulator.sp,
+        )
+        offset += RECORD.size
+        self.offset = HEADER.size if offset == self.end else offset
+
+    def to_bytes(self):
+        return bytes(self.buffer)
+
+    def close(self):
+        if self.file is not None:
+            self.buffer.flush()
+            self.buffer.close()
+            self.file.close()
+            self.file = None
+
+
+def decode_trace(data):
+    """(cycle, address, instruction byte, data, A, B, offset, stack depth) records of a trace, oldest first."""
+    if len(data) < HEADER.size or bytes(data[:4]) != MAGIC:
+        raise TraceException("Not a trace")
+    magic, version, capacity = HEADER.unpack_from(data)
+    if version != VERSION:
+        raise TraceException(f"Unsupported trace version {version}")
+    if len(data) < HEADER.size + RECORD.size * capacity:
+        raise TraceException("Truncated trace")
+    records = [record for record in RECORD.iter_unpack(data[HEADER.size:HEADER.size + RECORD.size * capacity]) if record[0]]
+    # Cycles only go up, so they put the ring back in order
+    records.sort()
+    return records
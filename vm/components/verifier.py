@@ -0,0 +1,114 @@
+from components import instructions as handlers
+from components.instructions import dispatch, is_bank_select
+from components.memory import HEAP_END
+from components.register import REGISTERS, REGISTER_START, INSTRUCTION_REGISTER
+from components.stack import STACK_SIZE
+
+class VerifyException(Exception):
+    pass
+
+HLT = 0b00110
+JMP = 0b01000
+CALL = 0b10001
+RET = 0b10010
+MOV = 0b01101
+STORES = {0b01001, 0b01010} # STA, STB
+STEPS = {0b01011, 0b01100} # INC, DEC
+CONDITIONAL_JUMPS = {0b01111, 0b10110, 0b10111, 0b11000, 0b11001, 0b11010}
+
+# Handlers that read stack[sp-data], which only holds one of the pushed addresses for 1 <= data <= sp
+STACK_OPERANDS = {
+    handlers.LDA_stack, handlers.LDA_stack_mem, handlers.LDB_stack, handlers.LDB_stack_mem,
+    handlers.PRX_stack, handlers.STA_stack, handlers.STB_stack, handlers.INC_stack, handlers.DEC_stack,
+    handlers.CALL_stack, handlers.OFF_stack, handlers.PRC_stack, handlers.BANK_stack, handlers.DUP,
+}
+# Jumps whose target is only known at run time
+COMPUTED_JUMPS = {handlers.JMP_mem, handlers.CALL_stack}
+
+# Handlers a verified instruction runs instead, without the checks verify() has already made
+UNCHECKED = {
+    handlers.STA: handlers.STA_unchecked,
+    handlers.STB: handlers.STB_unchecked,
+    handlers.INC: handlers.INC_register,
+    handlers.DEC: handlers.DEC_register,
+}
+
+def verify(image, banks=1, stack_size=STACK_SIZE, harvard=False):
+    """
+    Check every instruction reachable from address 0 of a ProgramImage,
+    raising a VerifyException for the first problem found, and return their
+    addresses. Bytes that are never run, such as the data section, are not
+    checked. The result is kept on the image for engines with the same
+    banks, stack size and mode, which load it with unchecked handlers.
+    """
+    key = (banks, stack_size, harvard)
+    result = image.verified.get(key)
+    if result is not None:
+        return result[0]
+    code = image.code
+    end = image.program_end
+    # Stores below this would change the program
+    code_end = 0 if harvard else end
+    unchecked = {}
+    seen = set()
+    pending = [0]
+
+    def target(address, destination, kind):
+        if destination % 2 or destination + 1 >= end:
+            raise VerifyException(f"{kind} at {address} to {destination}, which is not the start of an instruction")
+        pending.append(destination)
+
+    while pending:
+        address = pending.pop()
+        if address in seen:
+            continue
+        seen.add(address)
+        if address + 1 >= end:
+            raise VerifyException(f"Program runs off its end at {address}")
+        instruction_byte, data = code[address], code[address+1]
+        handler = dispatch[instruction_byte]
+        instruction = instruction_byte & 0b0001_1111
+        stack_flag = (instruction_byte & 0b0100_0000) >> 6
+        if handler is None:
+            raise VerifyException(f"Undefined instruction {instruction} at {address}")
+        if handler in COMPUTED_JUMPS:
+            raise VerifyException(f"Computed jump at {address}, its target can't be verified")
+        if handler in STACK_OPERANDS and not 1 <= data <= stack_size:
+            raise VerifyException(f"Stack operand {data} at {address} is outside a stack of {stack_size}")
+        if is_bank_select(instruction_byte) and handler is handlers.BANK and data >= banks:
+            raise VerifyException(f"No memory bank {data} ({banks} banks) at {address}")
+        if instruction == MOV:
+            into, from_ = 255-((data & 0b11110000) >> 4), 255-(data & 0b1111)
+            if into not in REGISTERS or from_ not in REGISTERS:
+                raise VerifyException(f"MOV at {address} names a register that does not exist ({data:08b})")
+            if into == INSTRUCTION_REGISTER:
+                raise VerifyException(f"Computed jump at {address}, MOV into the instruction register")
+        if instruction in STORES and not stack_flag:
+            if data < code_end or data >= HEAP_END:
+                raise VerifyException(f"Store to {'the program' if data < code_end else 'reserved address'} {data} at {address}")
+            unchecked[address] = (handler, UNCHECKED[handler])
+        if instruction in STEPS and not stack_flag:
+            if data < code_end or HEAP_END <= data < REGISTER_START:
+                raise VerifyException(f"Store to {'the program' if data < code_end else 'reserved address'} {data} at {address}")
+            if data == INSTRUCTION_REGISTER:
+                raise VerifyException(f"Computed jump at {address}, stepping the instruction register")
+            if data >= REGISTER_START:
+                unchecked[address] = (handler, UNCHECKED[handler])
+
+        if instruction == JMP:
+            target(address, data, "Jump")
+        elif instruction == CALL:
+            target(address, data, "Call")
+            pending.append(address + 2)
+        elif instruction in CONDITIONAL_JUMPS:
+            target(address, data, "Jump")
+            pending.append(address + 2)
+        elif instruction not in (HLT, RET):
+            pending.append(address + 2)
+    image.verified[key] = (sorted(seen), unchecked)
+    return sorted(seen)
+
+def unchecked_handlers(image, banks=1, stack_size=STACK_SIZE, harvard=False):
+    """(checked, unchecked) handlers by address to load a verified image with, verifying it first if needed."""
+    verify(image, banks, stack_size, harvard)
+    return image.verified[(banks, stack_size, harvard)][1]
@@ -1,2 +1,4 @@
+# Defaults for new engines only, each OctoEngine copies these when it is created
+# and takes its own debug and step arguments over them
 debug = False
-step = True
\ No newline at end of file
+step = True
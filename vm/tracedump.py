@@ -0,0 +1,33 @@
+"""
+Print a trace written by components.trace.TraceRecorder, oldest instruction first.
+
+    python vm/tracedump.py trace.bin [last]
+"""
+import os
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(root, "compiler", "hc"))
+
+from compiler.instructions import Instruction
+from components.trace import decode_trace
+
+def format_record(record):
+    cycle, address, instruction_byte, data, reg_a, reg_b, reg_offset, depth = record
+    if instruction_byte & 0b0011_1111 == Instruction.BANK.value:
+        name = Instruction.BANK.name
+    else:
+        name = Instruction(instruction_byte & 0b0001_1111).name
+    flags = ("mem " if instruction_byte & 0b1000_0000 else "") + ("stack " if instruction_byte & 0b0100_0000 else "")
+    return f"{cycle:>10} {address:>3}: {name:<5} {flags:<10}{data:>3}   A:{reg_a} B:{reg_b} O:{reg_offset} SP:{depth}"
+
+def format_trace(data, last=None):
+    records = decode_trace(data)
+    if last is not None:
+        records = records[-last:]
+    return "\n".join(format_record(record) for record in records)
+
+if __name__ == "__main__":
+    with open(sys.argv[1], "rb") as trace_file:
+        data = trace_file.read()
+    print(format_trace(data, int(sys.argv[2]) if len(sys.argv) > 2 else None))
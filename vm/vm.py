@@ -1,90 +1,470 @@
+import os
 import sys
+import asyncio
+import argparse
 
-from components.register import Register
-from components.memory import Memory
+# The compiler, for running .hatch source files. Set here so worker processes that re-import this module have it too
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(root, "compiler", "hc"))
 
-from components.instructions import instructions, InstructionException
+from components.memory import Memory, MemoryAccessException
+from components.paging import BankStoreMemory
+from components.allocator import BitmapAllocator, OutOfMemoryException
+from components.stack import STACK_SIZE, CALL_STACK_SIZE, overflow
+from components.output import ListSink, StdoutSink, StreamSink
+from components.input import InputSource, InputException
+from components.snapshot import Snapshot
+from components.register import REGISTERS
+
+from components.instructions import dispatch, debug_dispatch
+from components.image import ProgramImage, decode_instruction
+from components.hooks import DebugTracer, build_traced_dispatch_table
+from components.profiler import Profiler, HeapProfiler
+from components.trace import TraceRecorder
+from components.jit import BlockCompiler
+from components.verifier import unchecked_handlers
+from components.runner import BatchRunner, ThreadBatchRunner, load_program
+from components.limits import LimitException
 
 import settings
 
+traced_dispatch = build_traced_dispatch_table(dispatch)
+traced_debug_dispatch = build_traced_dispatch_table(debug_dispatch)
+
+UNDECODED = (None,) * 256
+
+# Cycles run() hands to run_cycles() at a time
+RUN_SLICE = 1 << 16
+
 class OctoEngine:
-    def __init__(self, redirect_output=False):
+    __slots__ = (
+        "halted", "redirect_output", "debug", "output", "sinks", "comparison",
+        "memory", "stack", "sp", "call_stack", "call_sp", "saved", "heap", "input",
+        "reg_a", "reg_b", "reg_counter", "instruction_register", "reg_func", "reg_offset",
+        "program_end", "image", "decoded", "tracers", "dispatch", "jit",
+        "cycles", "max_cycles", "max_call_depth", "peak_call_depth", "harvard", "code", "verify",
+    )
+
+    def __init__(self, redirect_output=False, debug=None, step=None, tracers=(), jit=False,
+                 stack_size=STACK_SIZE, call_stack_size=CALL_STACK_SIZE, sinks=None,
+                 input_source=None, max_cycles=None, max_heap=None, max_call_depth=None, banks=1,
+                 harvard=False, pages=None, verify=False):
         self.halted = False
         self.redirect_output = redirect_output
+        self.debug = settings.debug if debug is None else debug
         self.output = []
+        if sinks is None:
+            # Record into output, and unless redirected print as well (a character at a time while debugging)
+            sinks = [ListSink(self.output)]
+            if not redirect_output:
+                sinks.append(StdoutSink(threshold=0 if self.debug else 4096))
+        self.sinks = list(sinks)
         
-        self.comparisons = {"JE":False, "JG":False, "JL":False}
+        # reg_a - reg_b at the last CMP
+        self.comparison = 0
         
-        self.memory = Memory(self)
-        self.stack = []
-        self.call_stack = []
-        self.memory_map = {}
+        # With a PageCache the banks are kept in its backing store instead of in memory.
+        # With more than one bank the heap is never compacted, see compact_heap
+        self.memory = Memory(self, banks) if pages is None else BankStoreMemory(self, banks, pages)
+        # Instructions are fetched from here, a separate code space in Harvard mode and memory otherwise
+        self.harvard = harvard
+        self.code = bytearray(256) if harvard else self.memory.memory
+        # Fixed size stacks, sp and call_sp are the number of entries in use. Entries are
+        # heap addresses, saved registers and return addresses, which all fit in a byte
+        self.stack = bytearray(stack_size)
+        self.sp = 0
+        self.call_stack = bytearray(call_stack_size)
+        self.call_sp = 0
+        # Stack depths of the register pairs pushed by SAVE, heap compaction leaves these alone
+        self.saved = []
+        self.heap = BitmapAllocator(limit=max_heap)
 
-        self.read_buffer = []
+        # READ takes bytes from here, stdin unless given bytes, a file object or a file descriptor.
+        # Output waiting in a buffer is flushed first, so a prompt shows before READ blocks
+        self.input = InputSource(sys.stdin if input_source is None else input_source, before_read=self.flush_output)
         
         
-        self.reg_a = Register("A")
-        self.reg_b = Register("B")
-        self.reg_counter = Register("COUNTER")
-        self.instruction_register = Register("INST")
-        self.reg_func = Register("FUNC")
-        self.reg_offset = Register("OFFSET")
-        
-        self.memory.reserve(255, self.reg_a)
-        self.memory.reserve(254, self.reg_b)
-        self.memory.reserve(253, self.reg_counter)
-        self.memory.reserve(252, self.instruction_register)
-        self.memory.reserve(251, self.reg_func)
-        self.memory.reserve(250, self.reg_offset)
+        # Registers, also readable at their reserved memory addresses (see components.register)
+        self.reg_a = 0
+        self.reg_b = 0
+        self.reg_counter = 0
+        self.instruction_register = 0
+        self.reg_func = 0
+        self.reg_offset = 0
         
         self.program_end = 0
+        self.image = None
 
-    def load(self, bytestream):
-        for index, byte in enumerate(bytestream):
-            self.memory[index] = byte
-        self.program_end = len(bytestream)
-        for i in range(self.program_end, 256-16):
-            self.memory_map[i] = False
-        
+        # Usage counters, and the optional limits that raise a LimitException when a run goes over them
+        self.cycles = 0
+        self.peak_call_depth = 0
+        self.max_cycles = max_cycles
+        self.max_call_depth = max_call_depth
+        # Programs are verified as they are loaded, and run their verified instructions without the checks it made
+        self.verify = verify
+
+        # Predecoded (handler, mem_flag, stack_flag, data) entries, indexed by address
+        self.decoded = list(UNDECODED)
+
+        self.tracers = []
+        if self.debug:
+            self.tracers.append(DebugTracer(settings.step if step is None else step))
+        self.tracers += tracers
+        self.install_dispatch()
+
+        self.jit = BlockCompiler(self) if jit else None
+
+    def install_dispatch(self):
+        # Untraced engines run the bare handlers, tracing wrappers are only used while a tracer is registered
+        if self.tracers:
+            self.dispatch = traced_debug_dispatch if self.debug else traced_dispatch
+        else:
+            self.dispatch = debug_dispatch if self.debug else dispatch
+        self.decoded[:] = UNDECODED
+
+    def add_tracer(self, tracer):
+        self.tracers.append(tracer)
+        self.install_dispatch()
+
+    def remove_tracer(self, tracer):
+        self.tracers.remove(tracer)
+        self.install_dispatch()
+
+    def profile(self, function_addresses=None):
+        """Register and return a Profiler, function_addresses as returned by hc.compile(..., debug=True)."""
+        profiler = Profiler(function_addresses)
+        self.add_tracer(profiler)
+        return profiler
+
+    def profile_heap(self, capacity=4096):
+        """Register and return a HeapProfiler keeping the last capacity PUSH and FREE events."""
+        profiler = HeapProfiler(capacity)
+        self.add_tracer(profiler)
+        return profiler
+
+    def record_trace(self, capacity=65536, path=None):
+        """Register and return a TraceRecorder keeping the last capacity instructions, in a memory mapped file if path is given."""
+        recorder = TraceRecorder(capacity, path)
+        self.add_tracer(recorder)
+        return recorder
+
+    def load(self, program):
+        """Load a ProgramImage, or the program bytes to make one from."""
+        image = program if isinstance(program, ProgramImage) else ProgramImage(program)
+        # Rejected before anything changes, so the engine keeps the program it had
+        if image.data and not self.harvard:
+            raise MemoryAccessException("Program has separate data, it needs an OctoEngine(harvard=True)")
+        unchecked = None
+        if self.verify:
+            unchecked = unchecked_handlers(image, len(self.memory.banks), len(self.stack), self.harvard)
+        self.image = image
+        self.program_end = image.program_end
+        if self.harvard:
+            # Code has its own space, data starts at 0 and the heap follows it
+            self.code[0:self.program_end] = self.image.code
+            self.memory.load(self.image.data)
+            self.memory.code_end = -1
+            heap_start = self.image.data_end
+        else:
+            self.memory.load(self.image.code)
+            self.memory.code_end = self.program_end
+            heap_start = self.program_end
+        self.decoded[:] = self.image.decoded(self.dispatch, unchecked)
+        if self.jit is not None:
+            self.jit.reset()
+        self.heap.reset(heap_start, 256-16)
+        self.memory.reset_banks()
+        self.cycles = 0
+        self.peak_call_depth = 0
+
+    def decode(self, address):
+        if self.harvard:
+            entry = decode_instruction(self.dispatch, self.code[address], self.code[(address + 1) % 256], address)
+        else:
+            entry = decode_instruction(self.dispatch, self.memory.read(address), self.memory.read((address + 1) % 256), address)
+        # Only the loaded program is cached, anything else (including the registers) is read live every time
+        if address + 1 < self.program_end:
+            self.decoded[address] = entry
+        return entry
+
+    def invalidate(self, address):
+        # A store changes the instruction starting at this address and the data byte of the one before it
+        self.decoded[address] = None
+        self.decoded[address - 1] = None
+        if self.jit is not None:
+            self.jit.invalidate(address)
         
+    def compact_heap(self):
+        if len(self.memory.banks) > 1:
+            # Stack entries don't say which bank's heap they point into, so nothing can be moved safely
+            raise OutOfMemoryException(f"Out of memory, the heap is not compacted with {len(self.memory.banks)} banks")
+        moves = self.heap.compact()
+        memory = self.memory.memory
+        relocated = list(range(0, 256))
+        # Moves are in address order and always downwards, so earlier ones never overwrite later ones
+        for address, destination, length in moves:
+            memory[destination:destination+length] = memory[address:address+length]
+            relocated[address:address+length] = range(destination, destination+length)
+        saved = set()
+        for depth in self.saved:
+            saved.update((depth, depth+1))
+        for i in range(0, self.sp):
+            value = self.stack[i]
+            if i not in saved and 0 <= value <= 255:
+                self.stack[i] = relocated[value]
+        for tracer in self.tracers:
+            for address, destination, length in moves:
+                for moved in range(destination, destination+length):
+                    tracer.on_memory_write(self, moved, memory[moved])
+            tracer.on_compact(self, moves)
+        return moves
+
     def instruction_cycle(self):
-        start_instruction_register_value = self.instruction_register.value
-        instruction = self.memory[self.instruction_register.value] & 0b0001_1111
-        if not instruction in instructions:
-            raise InstructionException(f"Undefined instruction: {instruction} at memory address {self.instruction_register.value}")
-        mem_flag = (self.memory[self.instruction_register.value] & 0b1000_0000) >> 7
-        stack_flag = (self.memory[self.instruction_register.value] & 0b0100_0000) >> 6
-        self.instruction_register += 1
-        data = self.memory[self.instruction_register]
-        self.instruction_register += 1
-        instructions[instruction](self, mem_flag, stack_flag, data)
-        #print(sum([1 if not b == 0 else 0 for b in self.memory.memory[self.program_end:]])/len(self.memory.memory[self.program_end:]), len(self.memory.memory[self.program_end:]), len(self.stack))
-        if settings.debug:
-            print(f"Registers: A:{self.reg_a.value}, B:{self.reg_b.value}, F:{self.reg_func.value}, O:{self.reg_offset.value}, I:{start_instruction_register_value}")
-            print(f"Stack: {self.stack}")
-            length = 256-16-self.program_end
-            length = min(20, length)
-            print(f"Mem: {self.memory.memory[self.program_end:self.program_end+length]}")
-            if settings.step:
-                input()
-            else:
-                print()
+        if self.max_cycles is not None and self.cycles >= self.max_cycles:
+            raise LimitException("Cycle", self.max_cycles)
+        address = self.instruction_register
+        handler, mem_flag, stack_flag, data = self.decoded[address] or self.decode(address)
+        for tracer in self.tracers:
+            tracer.on_instruction(self, address, self.code[address] if self.harvard else self.memory.read(address), data)
+        self.instruction_register = (address + 2) % 256
+        self.cycles += 1
+        handler(self, mem_flag, stack_flag, data)
         
     def run(self):
-        while not self.halted:
-            self.instruction_cycle()
+        try:
+            while not self.halted:
+                self.run_cycles(RUN_SLICE)
+        finally:
+            # Output written before an error is not lost in a buffer
+            self.flush_output()
         return self.output
+
+    def run_cycles(self, cycles):
+        """Run at most cycles instructions, stopping early if the program halts. Returns the cycles left over."""
+        if self.tracers:
+            while cycles and not self.halted:
+                self.instruction_cycle()
+                cycles -= 1
+            return cycles
+        budget = cycles
+        if self.max_cycles is not None:
+            budget = min(cycles, self.max_cycles - self.cycles)
+            if budget <= 0 and not self.halted:
+                raise LimitException("Cycle", self.max_cycles)
+        if self.jit is not None:
+            return cycles - budget + self.jit.run(budget)
+        decoded = self.decoded
+        left = budget
+        try:
+            while left and not self.halted:
+                address = self.instruction_register
+                handler, mem_flag, stack_flag, data = decoded[address] or self.decode(address)
+                self.instruction_register = (address + 2) % 256
+                left -= 1
+                handler(self, mem_flag, stack_flag, data)
+        finally:
+            self.cycles += budget - left
+        return cycles - budget + left
+
+    @property
+    def usage(self):
+        """Cycles run, most heap bytes in use at once and deepest call depth since the program was loaded."""
+        return {"cycles": self.cycles, "heap_peak": self.heap.peak, "call_depth": self.peak_call_depth}
+
+    async def run_async(self, budget=1000, reader=None):
+        """
+        Run the program on an asyncio event loop, giving other tasks a turn
+        every budget cycles. When READ runs out of input, more is awaited from
+        reader (an asyncio.StreamReader or anything with an async read(n)).
+        With a reader, input already fed is kept but the engine's own source
+        is not read until run_async returns, as reading it would block the
+        event loop.
+        """
+        source = self.input.source
+        if reader is not None:
+            self.input.source = None
+        try:
+            while not self.halted:
+                try:
+                    self.run_cycles(budget)
+                except InputException:
+                    if reader is None:
+                        raise
+                    self.flush_output()
+                    data = await reader.read(self.input.chunk_size)
+                    if not data:
+                        raise
+                    self.feed(data)
+                    continue
+                await asyncio.sleep(0)
+        finally:
+            self.input.source = source
+            self.flush_output()
+        return self.output
+
+    def stream(self, threshold=0):
+        """Run the program, yielding its output as bytes chunks while it runs."""
+        sink = StreamSink(threshold)
+        self.sinks.append(sink)
+        try:
+            while not self.halted:
+                self.instruction_cycle()
+                if sink.chunks:
+                    yield from sink.chunks
+                    sink.chunks.clear()
+        finally:
+            self.sinks.remove(sink)
+
+    def snapshot(self):
+        """Copy of the machine state, see components.snapshot for turning it into bytes."""
+        return Snapshot(
+            bytes(self.memory.memory),
+            tuple(getattr(self, register) for register in REGISTERS.values()),
+            self.halted,
+            self.comparison,
+            self.program_end,
+            self.heap.occupied,
+            self.heap.compactions,
+            self.heap.bytes_moved,
+            bytes(self.stack[:self.sp]),
+            bytes(self.call_stack[:self.call_sp]),
+            tuple(self.saved),
+            tuple(self.output),
+            self.input.buffered(),
+            self.memory.bank,
+            self.memory.saved_banks(),
+        )
+
+    def restore(self, snapshot):
+        """Put the machine back into the state of a snapshot taken from an engine with the same stack sizes or smaller."""
+        if len(snapshot.banks) > len(self.memory.banks):
+            raise MemoryAccessException(f"No memory bank {len(snapshot.banks)-1} ({len(self.memory.banks)} banks)")
+        if len(snapshot.stack) > len(self.stack):
+            raise overflow("Stack", len(self.stack))
+        if len(snapshot.call_stack) > len(self.call_stack):
+            raise overflow("Call stack", len(self.call_stack))
+        self.memory.memory[:] = snapshot.memory
+        for register, value in zip(REGISTERS.values(), snapshot.registers):
+            setattr(self, register, value)
+        self.halted = snapshot.halted
+        self.comparison = snapshot.comparison
+        self.program_end = snapshot.program_end
+        if self.harvard:
+            # The code space is not part of a snapshot, the heap starts where the loaded program's data ends
+            self.heap.reset(self.heap.start, 256-16)
+        else:
+            self.memory.code_end = self.program_end
+            self.heap.reset(self.program_end, 256-16)
+        self.heap.occupied = snapshot.heap
+        self.heap.compactions = snapshot.compactions
+        self.heap.bytes_moved = snapshot.bytes_moved
+        self.sp = len(snapshot.stack)
+        self.stack[:self.sp] = snapshot.stack
+        self.call_sp = len(snapshot.call_stack)
+        self.call_stack[:self.call_sp] = snapshot.call_stack
+        self.saved[:] = snapshot.saved
+        # The sinks hold on to the output list, so it is refilled rather than replaced
+        self.output[:] = snapshot.output
+        self.input.clear()
+        self.input.feed(snapshot.input)
+        self.memory.restore_banks(snapshot.bank, snapshot.banks)
+        self.decoded[:] = UNDECODED
+        if self.jit is not None:
+            self.jit.reset()
+
+    def fork(self):
+        """
+        New engine in the same state, with the same settings but no tracers.
+        Sinks and the input source are not shared with it. It records into
+        its own copy of output and prints unless redirect_output is set, as
+        with the default sinks, whatever sinks were passed here. Its input is
+        only what is already buffered here, feed() it the rest.
+        """
+        child = OctoEngine(
+            self.redirect_output, self.debug, jit=self.jit is not None,
+            stack_size=len(self.stack), call_stack_size=len(self.call_stack), input_source=b"",
+            max_cycles=self.max_cycles, max_heap=self.heap.limit, max_call_depth=self.max_call_depth,
+            banks=len(self.memory.banks), harvard=self.harvard,
+            pages=self.memory.pages.empty_copy() if isinstance(self.memory, BankStoreMemory) else None,
+            verify=self.verify,
+        )
+        if self.harvard:
+            child.load(self.image)
+        if self.jit is not None:
+            child.jit.hot_threshold = self.jit.hot_threshold
+            child.jit.warmup = self.jit.warmup
+        child.restore(self.snapshot())
+        child.cycles = self.cycles
+        child.peak_call_depth = self.peak_call_depth
+        child.heap.peak = self.heap.peak
+        if child.dispatch is self.dispatch:
+            # Same memory and handlers, so the decoded instructions carry over
+            child.decoded[:] = self.decoded
+        return child
+
+    def feed(self, data):
+        """Queue bytes for READ, after any input that is already buffered."""
+        self.input.feed(data)
+
+    def flush_output(self):
+        for sink in self.sinks:
+            sink.flush()
             
     def halt(self):
         self.halted = True
+        self.flush_output()
         
 
 
+def input_files(paths):
+    # A directory stands for every file in it, in name order
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if os.path.isfile(os.path.join(path, name)):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+def read_file(path):
+    with open(path, "rb") as input_file:
+        return input_file.read()
+
 if __name__ == "__main__":
-    emulator = OctoEngine()
-    if len(sys.argv) > 1:
-        with open(sys.argv[1], "rb") as input_file:
-            emulator.load(input_file.read())
-    else:
+    parser = argparse.ArgumentParser(description="Run a compiled Hatch program")
+    parser.add_argument("program", nargs="?", help=".hb file or .hatch source file to run")
+    parser.add_argument("inputs", nargs="*", help="input files or directories, the program is run once for each with it as stdin")
+    parser.add_argument("--jobs", "-j", type=int, default=None, help="workers for runs over inputs (default: one per CPU)")
+    parser.add_argument("--threads", action="store_true", help="run the workers as threads instead of processes")
+    parser.add_argument("--max-cycles", type=int, default=None, help="stop a run after this many instructions")
+    parser.add_argument("--max-heap", type=int, default=None, help="most heap bytes a run may have allocated at once")
+    parser.add_argument("--max-call-depth", type=int, default=None, help="deepest a run may nest calls")
+    parser.add_argument("--verify", action="store_true", help="verify the program before running it, rejecting it if it fails")
+    arguments = parser.parse_args()
+    limits = {"max_cycles": arguments.max_cycles, "max_heap": arguments.max_heap, "max_call_depth": arguments.max_call_depth}
+    if arguments.verify:
+        # Passed to each OctoEngine along with the limits
+        limits["verify"] = True
+
+    if arguments.program is None:
         print("No input file")
-    emulator.run()
\ No newline at end of file
+        OctoEngine().run()
+    elif not arguments.inputs:
+        emulator = OctoEngine(**limits)
+        emulator.load(load_program(arguments.program))
+        emulator.run()
+    else:
+        names = list(input_files(arguments.inputs))
+        runner = (ThreadBatchRunner if arguments.threads else BatchRunner)(arguments.jobs, limits=limits)
+        # Each worker loads the program from its path, compiling it if it is .hatch source
+        results = runner.run((arguments.program, read_file(name)) for name in names)
+        failed = False
+        for name, result in zip(names, results):
+            sys.stdout.buffer.write(b"==> %s <==\n" % name.encode())
+            sys.stdout.buffer.write(result.printed)
+            if result.error is not None:
+                failed = True
+                sys.stdout.buffer.write(b"%s: %s\n" % (type(result.error).__name__.encode(), str(result.error).encode()))
+            sys.stdout.buffer.flush()
+        print(runner.stats, file=sys.stderr)
+        sys.exit(1 if failed else 0)